@@ -21,13 +21,36 @@
 
 import logging
 import math
+import time
+import random
+import threading
+import queue
+import collections
+import bisect
+import re
+import contextlib
+import functools
+import itertools
+import tempfile
+import io
+import os
+import shutil
+import pickle
+import gzip
 import hashlib
+import hmac
 import base64
-from datetime import datetime
+import http.server
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from dateutil import parser as dateparser
 import json
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import sqlalchemy
 from sqlalchemy.types import BLOB
 
@@ -35,533 +58,3389 @@ __version__ = '0.6.2'
 
 module_logger = logging.getLogger(__name__)
 
+
+
+class TokenBucket:
+    # A client-side rate limiter shared by all threads that talk to the API.
+    # Holds up to «capacity» tokens, refilled at «rate» tokens per second.
+
+    def __init__(self,rate,capacity=None):
+        self.rate=rate
+        self.capacity=capacity if capacity else rate
+        self.tokens=self.capacity
+        self.last=time.monotonic()
+        self.lock=threading.Lock()
+
+
+    def take(self):
+        # Block until a token is available and return the seconds spent waiting
+        waited=0
+        while True:
+            with self.lock:
+                now=time.monotonic()
+                self.tokens=min(self.capacity, self.tokens + (now-self.last)*self.rate)
+                self.last=now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                wait=(1-self.tokens)/self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+
+class ChunkSizer:
+    # Splits DataFrames into chunks to be written to DB by size in bytes, not
+    # rows, since an answer can be a number or pages of text. Starts with
+    # chunks of «initial» bytes and, after each chunk written, steers the size
+    # so a chunk takes about «target» seconds at the throughput measured so
+    # far, between «minimum» and «limit» bytes.
+
+    def __init__(self,initial,target,limit,minimum=64*1024):
+        self.minimum=minimum
+        self.limit=max(minimum,limit)
+        self.bytes=min(max(minimum,initial),self.limit)
+        self.target=target
+        self.rate=None # bytes/s
+        self.lock=threading.Lock()
+
+
+    def rowSizes(self,df):
+        # Estimated bytes of each row as sent to DB
+        sizes=np.full(df.shape[0],4*df.shape[1],dtype=np.int64)
+
+        for c in df.columns:
+            if isinstance(df[c].dtype,pd.CategoricalDtype):
+                # Each category measured once
+                codes=df[c].cat.codes.to_numpy()
+                categories=np.append(self.textBytes(pd.Series(df[c].cat.categories)),8)
+                sizes += categories[codes]
+            elif pd.api.types.is_object_dtype(df[c]) or pd.api.types.is_string_dtype(df[c]):
+                sizes += self.textBytes(df[c])
+            elif pd.api.types.is_datetime64_any_dtype(df[c]):
+                sizes += 19
+            else:
+                sizes += 8
+
+        return sizes
+
+
+    @staticmethod
+    def textBytes(column):
+        # UTF-8 bytes of each value of a text column, as they go over the
+        # wire: non-Latin text takes up to 4 bytes per character
+        try:
+            return column.str.encode('utf-8').str.len().fillna(8).to_numpy(dtype=np.int64)
+        except AttributeError:
+            # No strings at all in this column
+            return np.full(column.shape[0],8,dtype=np.int64)
+
+
+    def chunks(self,df):
+        # Generator of (slice, bytes) for consecutive slices of «df», each of
+        # about self.bytes at the time it is taken
+        if df.shape[0] == 0:
+            return
+
+        ends=np.cumsum(self.rowSizes(df))
+        start=0
+
+        while start < df.shape[0]:
+            base=ends[start-1] if start > 0 else 0
+            end=max(start+1,int(np.searchsorted(ends,base + self.bytes,side='right')))
+
+            yield (df.iloc[start:end],int(ends[end-1]-base))
+            start=end
+
+
+    def record(self,size,seconds):
+        # Learn from a chunk of «size» bytes written in «seconds»
+        if seconds <= 0:
+            return
+
+        with self.lock:
+            rate=size/seconds
+            self.rate=rate if self.rate is None else (self.rate + rate)/2
+
+            # Grow at most twice at a time, in case it was a lucky chunk
+            self.bytes=int(min(self.limit, 2*self.bytes, max(self.minimum, self.rate*self.target)))
+
+
+
+class PollScheduler:
+    # When to poll each form for new responses, from its recent response
+    # rate: a form is polled when about «target» new responses are expected,
+    # but not more often than every «minimum» seconds nor less often than
+    # every «maximum». Rates are smoothed over polls. Forms never seen are
+    # due right away.
+
+    def __init__(self,minimum=60,maximum=4*3600,target=1,smoothing=0.5):
+        self.minimum=minimum
+        self.maximum=maximum
+        self.target=target
+        self.smoothing=smoothing
+        self.rates={} # form → responses/s
+        self.polled={} # form → time of last poll
+        self.next={} # form → time of next poll
+
+
+    def interval(self,form):
+        rate=self.rates.get(form,0)
+        if rate <= 0:
+            return self.maximum
+
+        return min(self.maximum,max(self.minimum,self.target/rate))
+
+
+    def seed(self,form,rate,now):
+        # Rate known from history, before first poll
+        self.rates[form]=rate
+        self.polled[form]=now
+        self.next[form]=now
+
+
+    def due(self,forms,now):
+        return [f for f in forms if self.next.get(f,now) <= now]
+
+
+    def record(self,form,responses,now):
+        # Learn from a poll that brought «responses» new responses
+        if form in self.polled and now > self.polled[form]:
+            rate=responses/(now - self.polled[form])
+            self.rates[form]=rate if form not in self.rates else self.smoothing*rate + (1-self.smoothing)*self.rates[form]
+        elif responses > 0:
+            # First poll of a form: anything new makes it look busy
+            self.rates[form]=self.target/self.minimum
+
+        self.polled[form]=now
+        self.next[form]=now + self.interval(form)
+
+
+    def wait(self,now):
+        # Seconds until next form is due, if any
+        if len(self.next) == 0:
+            return None
+
+        return max(0,min(self.next.values()) - now)
+
+
+
+class Metrics:
+    # Counters and timers of a sync, in total and per form, table, stage or
+    # API endpoint, plus histograms of API latency per endpoint. Thread safe.
+    # Names ending in «Seconds» are times, «Bytes» are sizes.
+
+    latencyBuckets=[0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60] # seconds
+
+    def __init__(self):
+        self.totals=collections.Counter()
+        self.series=collections.Counter() # (name, label, value) → number
+        self.histograms={} # endpoint → [count per bucket…, +Inf count, sum]
+        self.lock=threading.Lock()
+        self.started=time.time()
+
+
+    def count(self,name,value=1,**labels):
+        with self.lock:
+            self.totals[name] += value
+            for label,labelValue in labels.items():
+                if labelValue is not None:
+                    self.series[(name,label,labelValue)] += value
+
+
+    @contextlib.contextmanager
+    def timer(self,name,**labels):
+        start=time.monotonic()
+        try:
+            yield
+        finally:
+            self.count(name,time.monotonic()-start,**labels)
+
+
+    def observe(self,endpoint,seconds):
+        with self.lock:
+            histogram=self.histograms.setdefault(endpoint,[0]*(len(self.latencyBuckets)+2))
+            histogram[bisect.bisect_left(self.latencyBuckets,seconds)] += 1
+            histogram[-1] += seconds
+
+
+    def by(self,label):
+        # {label value: {name: number}}, as {'F00001': {'apiRequests': 3, …}}
+        grouped=collections.defaultdict(dict)
+        with self.lock:
+            for (name,l,value),number in self.series.items():
+                if l == label:
+                    grouped[value][name]=number
+
+        return dict(sorted(grouped.items()))
+
+
+    def prometheus(self,prefix='typeform_etl'):
+        # All metrics in Prometheus text exposition format, as gauges of the
+        # last sync, for node exporter's textfile collector
+        def metric(name):
+            return prefix + '_' + re.sub(r'(?<!^)(?=[A-Z])','_',name).lower()
+
+        def escape(value):
+            return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+        lines=[]
+        with self.lock:
+            names=sorted(set(self.totals) | {name for name,l,v in self.series})
+
+            for name in names:
+                lines.append('# TYPE {} gauge'.format(metric(name)))
+                lines.append('{} {}'.format(metric(name),self.totals[name]))
+
+                # One family per label, so sum() over a family is the total
+                for label in sorted({l for n,l,v in self.series if n == name}):
+                    family=metric(name) + '_by_' + label
+                    lines.append('# TYPE {} gauge'.format(family))
+
+                    for (n,l,value),number in sorted(self.series.items(),key=lambda s: str(s[0][2])):
+                        if n == name and l == label:
+                            lines.append('{}{{{}="{}"}} {}'.format(family,label,escape(value),number))
+
+            if self.histograms:
+                name=metric('apiLatencySeconds')
+                lines.append('# TYPE {} histogram'.format(name))
+
+                for endpoint,histogram in sorted(self.histograms.items()):
+                    cumulative=0
+                    for bound,count in zip(self.latencyBuckets + ['+Inf'],histogram[:-1]):
+                        cumulative += count
+                        lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'.format(name,escape(endpoint),bound,cumulative))
+
+                    lines.append('{}_sum{{endpoint="{}"}} {}'.format(name,escape(endpoint),histogram[-1]))
+                    lines.append('{}_count{{endpoint="{}"}} {}'.format(name,escape(endpoint),cumulative))
+
+        lines.append('# TYPE {} gauge'.format(metric('syncTimestampSeconds')))
+        lines.append('{} {}'.format(metric('syncTimestampSeconds'),time.time()))
+
+        return '\n'.join(lines) + '\n'
+
+
+    def snapshot(self):
+        # Everything, as a JSON-able dict
+        with self.lock:
+            histograms={
+                endpoint: dict(zip([str(b) for b in self.latencyBuckets] + ['+Inf','sum'],h))
+                for endpoint,h in self.histograms.items()
+            }
+
+        return {
+            'seconds':  time.time()-self.started,
+            'totals':   dict(self.totals),
+            'stage':    self.by('stage'),
+            'endpoint': self.by('endpoint'),
+            'form':     self.by('form'),
+            'table':    self.by('table'),
+            'latency':  histograms
+        }
+
+
+    def writePrometheus(self,path,prefix='typeform_etl'):
+        # Atomically, so node exporter never reads a file half written
+        with open(path + '.new','w') as f:
+            f.write(self.prometheus(prefix))
+        os.replace(path + '.new',path)
+
+
+
+class Checkpoint:
+    # Local on-disk record of the progress of a sync, so an interrupted sync
+    # can be resumed instead of started over.
+    # For each form and completion state, keeps the watermark it was synced
+    # from, the 'before' token of the last page done, the newest response
+    # time seen and, optionally, the transformed pages themselves.
+
+    def __init__(self,path):
+        self.path=path
+        self.manifest=os.path.join(path,'checkpoint.json')
+        self.lock=threading.Lock()
+
+        os.makedirs(path,exist_ok=True)
+
+        try:
+            with open(self.manifest) as f:
+                self.streams=json.load(f)
+        except FileNotFoundError:
+            self.streams={}
+
+
+    def key(self,form,completed):
+        return '{}.{}'.format(form,'completed' if completed else 'partial')
+
+
+    def save(self):
+        # Write manifest atomically, so a crash never leaves it half written
+        with open(self.manifest + '.new','w') as f:
+            json.dump(self.streams,f)
+        os.replace(self.manifest + '.new',self.manifest)
+
+
+    def resume(self,form,completed,since):
+        # State left by a previous run for this form, if it synced from the
+        # same watermark
+        with self.lock:
+            state=self.streams.get(self.key(form,completed))
+            if state and state['since'] == since:
+                return dict(state)
+
+
+    def start(self,form,completed,since):
+        with self.lock:
+            self.streams[self.key(form,completed)]={'since': since, 'before': None, 'pages': 0, 'watermark': None, 'done': False}
+            self.save()
+
+
+    def page(self,form,completed,before,watermark,frames=None):
+        # Record a page as done; store its frames if they aren't in DB yet
+        with self.lock:
+            state=self.streams[self.key(form,completed)]
+
+            if frames is not None:
+                with open(os.path.join(self.path,'{}.{:06d}.pkl'.format(self.key(form,completed),state['pages'])),'wb') as f:
+                    pickle.dump(frames,f)
+
+            state['pages'] += 1
+            state['before']=before
+            state['watermark']=watermark.isoformat()
+            self.save()
+
+
+    def finish(self,form,completed):
+        with self.lock:
+            self.streams[self.key(form,completed)]['done']=True
+            self.save()
+
+
+    def frames(self,form,completed):
+        # Generator of stored frames of a form
+        for page in range(self.streams[self.key(form,completed)]['pages']):
+            file=os.path.join(self.path,'{}.{:06d}.pkl'.format(self.key(form,completed),page))
+            if os.path.exists(file):
+                with open(file,'rb') as f:
+                    yield pickle.load(f)
+
+
+    def clear(self):
+        with self.lock:
+            shutil.rmtree(self.path,ignore_errors=True)
+            os.makedirs(self.path,exist_ok=True)
+            self.streams={}
+
+
+
+class PageCache:
+    # Raw API pages on disk, for replay without network. Each page is a
+    # gzipped JSON lines file: first line is the page without its items,
+    # then one line per item. Pages are keyed by a path-like tuple of names.
+    # The first line also gets «cacheSequence», [start of this cache object,
+    # pages stored before], so pages sort in the order they were written by
+    # all syncs, even after the files are copied.
+
+    def __init__(self,path):
+        self.path=path
+        self.started=time.time_ns()
+        self.stored=itertools.count()
+
+
+    def file(self,*key):
+        return os.path.join(self.path,*key) + '.jsonl.gz'
+
+
+    def store(self,page,*key):
+        file=self.file(*key)
+        os.makedirs(os.path.dirname(file),exist_ok=True)
+
+        header={k: v for k,v in page.items() if k != 'items'}
+        header['cacheSequence']=[self.started,next(self.stored)]
+
+        with gzip.open(file + '.new','wt',encoding='utf-8') as f:
+            f.write(json.dumps(header,ensure_ascii=False) + '\n')
+            for item in page.get('items') or []:
+                f.write(json.dumps(item,ensure_ascii=False) + '\n')
+
+        os.replace(file + '.new',file)
+
+
+    def load(self,*key):
+        with gzip.open(self.file(*key),'rt',encoding='utf-8') as f:
+            page=json.loads(f.readline())
+            items=[json.loads(line) for line in f]
+
+        if len(items) > 0 or 'total_items' in page:
+            page['items']=items
+
+        return page
+
+
+    def has(self,*key):
+        return os.path.exists(self.file(*key))
+
+
+    def keys(self,*key):
+        # Sorted names of pages or groups of pages under «key»
+        try:
+            names=os.listdir(os.path.join(self.path,*key))
+        except FileNotFoundError:
+            return []
+
+        return sorted(n[:-len('.jsonl.gz')] if n.endswith('.jsonl.gz') else n for n in names if not n.endswith('.new'))
+
+
+
+class ParquetSink:
+    # Columnar copy of everything written to DB, as Parquet files under a
+    # folder, one Hive partitioned dataset per table:
+    #   forms/part-….parquet
+    #   form_items/form=…/part-….parquet
+    #   responses/form=…/landed_day=YYYY-MM-DD/part-….parquet
+    #   answers/form=…/landed_day=YYYY-MM-DD/part-….parquet
+    # Files are only added, one per partition and write, named in write
+    # order, so the newest version of a row is the one in the last file.
+    # Deleted responses get a tombstone file, «_deleted-part-….parquet»
+    # with their IDs in a 'response' column, in the partitions of their
+    # responses and answers; readers skip files starting with «_».
+    # compact() merges the files of a partition into one, keeping only the
+    # newest version of each row and dropping rows written before a
+    # tombstone of their response.
+
+    compactFiles=4 # partitions with this many files or more are compacted
+
+    partitions={
+        'forms':      [],
+        'form_items': ['form'],
+        'responses':  ['form','landed_day'],
+        'answers':    ['form','landed_day']
+    }
+
+    # Columns that are not strings; all others are
+    types={
+        'forms':      {'updated': 'timestamp'},
+        'form_items': {'position': 'int32'},
+        'responses':  {'landed': 'timestamp', 'submitted': 'timestamp'},
+        'answers':    {'sequence': 'int32'}
+    }
+
+    def __init__(self,path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError('Parquet sink needs pyarrow; install it with: pip install TypeformETL[parquet]') from error
+
+        self.pa=pyarrow
+        self.pq=pyarrow.parquet
+        self.path=path
+        self.lock=threading.Lock()
+        self.touched=set() # partition folders written since last compaction
+        self.prefix='part-' + datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        self.sequence=0
+
+        os.makedirs(path,exist_ok=True)
+
+
+    def schema(self,table,columns):
+        types={
+            'timestamp': self.pa.timestamp('us'),
+            'int32':     self.pa.int32()
+        }
+
+        return self.pa.schema([
+            (c,types[self.types[table][c]] if c in self.types[table] else self.pa.string())
+            for c in columns
+        ])
+
+
+    def fileName(self):
+        with self.lock:
+            self.sequence += 1
+            return '{}-{:06d}.parquet'.format(self.prefix,self.sequence)
+
+
+    def writeFile(self,folder,name,df,table):
+        # Write atomically, so readers never see a half written file
+        columns=[c for c in df.columns if c not in self.partitions[table]]
+
+        data=df[columns].copy()
+        for c in columns:
+            if c in self.types[table]:
+                if self.types[table][c] == 'timestamp':
+                    data[c]=pd.to_datetime(data[c],utc=True).dt.tz_localize(None)
+            else:
+                # Categoricals and Arrow strings as plain strings, so all files
+                # of a table have the same schema
+                data[c]=data[c].astype(object).where(data[c].notna(),None)
+
+        arrow=self.pa.Table.from_pandas(data,schema=self.schema(table,columns),preserve_index=False)
+
+        os.makedirs(folder,exist_ok=True)
+        file=os.path.join(folder,name)
+        self.pq.write_table(arrow,file + '.new')
+        os.replace(file + '.new',file)
+
+
+    def write(self,entities):
+        # Write a list of (df, table) as new files, split in partitions.
+        # Answers are partitioned by the landed day of their responses, which
+        # come in the same list. Table 'deleted' has responses deleted from
+        # DB (id, form, landed), written as tombstones. Returns number of
+        # files written.
+        landed={}
+        for df,table in entities:
+            if table == 'responses':
+                landed.update(zip(
+                    df['id'].astype(str),
+                    pd.to_datetime(df['landed'],utc=True).dt.strftime('%Y-%m-%d').fillna('unknown')
+                ))
+
+        files=0
+
+        for df,table in entities:
+            if df.shape[0] == 0:
+                continue
+
+            if table == 'deleted':
+                files += self.writeTombstones(df)
+                continue
+
+            if table == 'responses':
+                df=df.assign(landed_day=df['id'].astype(str).map(landed))
+            elif table == 'answers':
+                df=df.assign(landed_day=df['response'].astype(str).map(landed).fillna('unknown'))
+
+            keys=self.partitions[table]
+
+            if len(keys) == 0:
+                groups=[((),df)]
+            else:
+                groups=df.groupby([df[k].astype(str) for k in keys],sort=True)
+
+            for values,part in groups:
+                if not isinstance(values,tuple):
+                    values=(values,)
+
+                folder=os.path.join(self.path,table,*('{}={}'.format(k,v) for k,v in zip(keys,values)))
+                self.writeFile(folder,self.fileName(),part,table)
+
+                with self.lock:
+                    self.touched.add((table,folder))
+
+                files += 1
+
+        return files
+
+
+    def writeTombstones(self,deleted):
+        # One tombstone file per partition of the deleted responses, in
+        # responses and in answers
+        deleted=deleted.assign(
+            response=deleted['id'].astype(str),
+            landed_day=pd.to_datetime(deleted['landed'],utc=True).dt.strftime('%Y-%m-%d').fillna('unknown')
+        )
+
+        files=0
+
+        for (form,day),part in deleted.groupby([deleted['form'].astype(str),'landed_day'],sort=True):
+            name='_deleted-' + self.fileName()
+
+            for table in ['responses','answers']:
+                folder=os.path.join(self.path,table,'form={}'.format(form),'landed_day={}'.format(day))
+
+                os.makedirs(folder,exist_ok=True)
+                file=os.path.join(folder,name)
+                self.pq.write_table(self.pa.Table.from_pandas(part[['response']],preserve_index=False),file + '.new')
+                os.replace(file + '.new',file)
+
+                with self.lock:
+                    self.touched.add((table,folder))
+
+                files += 1
+
+        return files
+
+
+    def compact(self):
+        # Merge files of partitions written since last compaction that have
+        # self.compactFiles or more, or any tombstone, keeping the newest
+        # version of each row and dropping the ones deleted after it was
+        # written. The merged file takes the name of the newest one, so it
+        # still sorts before anything written later. Returns number of files
+        # removed.
+        with self.lock:
+            touched=sorted(self.touched)
+            self.touched=set()
+
+        removed=0
+
+        for table,folder in touched:
+            # Data files and tombstones, in write order
+            files=sorted(
+                (f for f in os.listdir(folder) if f.endswith('.parquet')),
+                key=lambda f: f[len('_deleted-'):] if f.startswith('_deleted-') else f
+            )
+            tombstones=[f for f in files if f.startswith('_deleted-')]
+            data=[f for f in files if not f.startswith('_deleted-')]
+
+            if len(data) < self.compactFiles and len(tombstones) == 0:
+                continue
+
+            # Plain files, without partition columns from folder names.
+            # Files from webhooks lack some columns.
+            tables=[]
+            deleted={} # response → position of its last tombstone
+            for position,f in enumerate(files):
+                part=self.pq.ParquetFile(os.path.join(folder,f)).read()
+
+                if f.startswith('_deleted-'):
+                    deleted.update((r,position) for r in part.column('response').to_pylist())
+                else:
+                    tables.append(part.append_column('_position',self.pa.array([position]*part.num_rows,self.pa.int32())))
+
+            if len(tables) > 0:
+                try:
+                    merged=self.pa.concat_tables(tables,promote_options='default')
+                except TypeError:
+                    # pyarrow before 14
+                    merged=self.pa.concat_tables(tables,promote=True)
+                merged=merged.to_pandas()
+
+                if deleted:
+                    response=merged['id' if table == 'responses' else 'response'].astype(str)
+                    merged=merged[~(response.map(deleted) > merged['_position'])]
+
+                merged=merged.drop(columns='_position').drop_duplicates(subset='id',keep='last')
+            else:
+                merged=pd.DataFrame()
+
+            if merged.shape[0] > 0:
+                self.writeFile(folder,data[-1],merged,table)
+                kept=[data[-1]]
+            else:
+                kept=[]
+
+            for f in files:
+                if f not in kept:
+                    os.remove(os.path.join(folder,f))
+
+            removed += len(files)-len(kept)
+
+        return removed
+
+
+
+class WebhookReceiver:
+    # HTTP endpoint for Typeform webhooks. Each delivery is checked against
+    # its Typeform-Signature header, an HMAC-SHA256 of the body with the
+    # webhook «secret», and its payload is handed to «accept». Answers right
+    # away; writing to DB is left to whoever accepts.
+
+    maxBody=4*1024*1024 # bytes; Typeform deliveries are a few KB
+
+    def __init__(self,port,accept,secret,host='0.0.0.0'):
+        if not secret:
+            raise ValueError('Webhooks need a secret to check their signature')
+
+        self.accept=accept
+        self.secret=secret
+
+        handler=type('Handler',(WebhookHandler,),{'receiver': self})
+        self.server=http.server.ThreadingHTTPServer((host,port),handler)
+        self.server.daemon_threads=True
+        self.port=self.server.server_port
+
+
+    @staticmethod
+    def sign(secret,body):
+        return 'sha256=' + base64.b64encode(hmac.new(secret.encode('utf-8'),body,hashlib.sha256).digest()).decode('ascii')
+
+
+    def verify(self,body,signature):
+        return signature is not None and hmac.compare_digest(self.sign(self.secret,body),signature)
+
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever,name='TypeformETL-webhooks',daemon=True).start()
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+
+class WebhookHandler(http.server.BaseHTTPRequestHandler):
+    receiver=None
+
+    def log_message(self,format,*args):
+        pass
+
+
+    def reply(self,status,message):
+        body=json.dumps({'message': message}).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_POST(self):
+        # Nothing is read before knowing it is a sane size
+        try:
+            length=int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.close_connection=True
+            return self.reply(411,'Content-Length required')
+
+        if length < 0 or length > self.receiver.maxBody:
+            self.close_connection=True
+            return self.reply(413,'Body too large')
+
+        body=self.rfile.read(length)
+
+        if not self.receiver.verify(body,self.headers.get('Typeform-Signature')):
+            return self.reply(403,'Invalid signature')
+
+        try:
+            payload=json.loads(body)
+        except ValueError:
+            return self.reply(400,'Invalid JSON')
+
+        if payload.get('event_type') != 'form_response' or 'form_response' not in payload:
+            # Typeform also sends pings and other events; nothing to do
+            return self.reply(200,'Ignored')
+
+        self.receiver.accept(payload)
+        self.reply(200,'Accepted')
+
+
+
+class IDMaker:
+    # IDs of hidden form items and of answers are base85 encoded digests of
+    # the content that identifies them. The same hidden field IDs show up in
+    # every response, so single IDs are memoized in a LRU cache; answer IDs
+    # are all different and are computed in batches instead.
+    # 'shake_256' is the original digest. 'blake2b', optionally keyed, is
+    # faster but gives different IDs, so it is only for new databases.
+
+    digests=['shake_256','blake2b']
+
+    def __init__(self,digest='shake_256',key=None,size=20,memo=65536):
+        if digest not in self.digests:
+            raise ValueError('Unknown ID digest «{}»; use one of {}'.format(digest,self.digests))
+
+        if key and digest != 'blake2b':
+            raise ValueError('Only blake2b IDs can be keyed')
+
+        self.size=size
+        self.name=digest
+
+        # Digest of a string, as bytes
+        if digest == 'blake2b':
+            key=key.encode('UTF-8') if key else b''
+            self.digest=lambda content: hashlib.blake2b(content.encode('UTF-8'),digest_size=size,key=key).digest()
+        else:
+            self.digest=lambda content: hashlib.shake_256(content.encode('UTF-8')).digest(size)
+
+        self.make=functools.lru_cache(maxsize=memo)(self.makeOne)
+
+
+    def makeOne(self,content):
+        return base64.b85encode(self.digest(content)).decode('ascii')
+
+
+    def fingerprint(self):
+        # Digest name and a sample ID, which also tells keys apart without
+        # revealing them
+        return '{}:{}'.format(self.name,self.makeOne('TypeformETL'))
+
+
+    def makeMany(self,contents):
+        # Base85 encodes groups of 4 bytes, so when digest size is a multiple
+        # of 4 all digests can be encoded in one call and sliced afterwards.
+        if self.size % 4 != 0:
+            return [self.makeOne(c) for c in contents]
+
+        digest=self.digest
+        encoded=base64.b85encode(b''.join([digest(c) for c in contents])).decode('ascii')
+        width=self.size*5//4
+
+        return [encoded[k:k+width] for k in range(0,len(encoded),width)]
+
+
+
 class TypeformETL:
     
     # API paremeters
-    workspaceListURL='https://api.typeform.com/workspaces'
+    workspaceListURL='https://api.typeform.com/workspaces?page_size=200&page={page}'
     formListURL='https://api.typeform.com/forms?page_size=200&page={page}'
     formItemsURL='https://api.typeform.com/forms/{id}'
     respListURL='https://api.typeform.com/forms/{id}/responses?since={since}&page_size={psize}&page={page}&completed={completed}'
+    respReconcileURL='https://api.typeform.com/forms/{id}/responses?since={since}&page_size={psize}'
+    respIDsURL='https://api.typeform.com/forms/{id}/responses?page_size={psize}&included_response_ids={ids}'
+    respPageSize=1000 # maximum allowed by Typeform
     typeformHeader=None
+    listWorkers=4 # pages of form and workspace lists fetched in parallel
+
+    # HTTP session parameters
+    session=None
+    rateLimiter=None
+    apiRateLimit=2 # requests per second, as documented by Typeform; None to disable
+    apiRateBurst=2 # requests
+    apiTimeout=60 # seconds
+    apiRetries=6
+    apiBackoff=1 # seconds, doubled on each retry
+    apiRetryStatus=[429, 500, 502, 503, 504]
+
+    
+    # DB parameters
+    db=None
+    watermarks=None
+    storedWatermarks=None
+    storedForms=None
+    dbChunkBytes=4*2**20 # bytes per chunk written to DB, initially; adapted as it goes
+    dbChunkSeconds=1 # target time to write a chunk
+    dbChunkMaxBytes=64*2**20 # bytes; also kept under the server packet limit, if any
+    dbChunkSizers=None # per table and write method
+    dbMaxParameters=30000 # bound parameters per INSERT statement
+    dbStagingThreshold=10000 # records; smaller deltas are upserted without staging table
+    dbConnections=1 # connections loading staging tables in parallel; SQLite always uses 1
+
+    # Reconciliation of recent responses with Typeform
+    reconcileDays=None # days of responses compared on each sync; None to disable
+    reconcileBatch=100 # response IDs per request of included_response_ids
+
+    # Columnar copy of everything written to DB
+    sink=None
+    sinkPending=None # (df, table) written in each open transaction, by connection
+    stagingUsed=None # staging tables locked by each open transaction, by connection
+
+    # Daemon mode
+    scheduler=None
+    stopping=None
+    pollForms=None # forms polled for responses in this cycle
+    pollMinInterval=60 # seconds between polls of the busiest forms
+    pollMaxInterval=4*3600 # seconds between polls of dormant forms
+    pollTarget=1 # new responses expected per poll
+    pollListInterval=15*60 # seconds between cycles at most, to find new forms
+    pollHistoryDays=7 # days of responses in DB to estimate initial rates from
+    reconcileInterval=6*3600 # seconds between reconciliations in daemon mode
+    writeLock=None # one writer at a time: sync cycle or webhook batch
+
+    # Webhooks
+    webhooks=None
+    webhookPort=None
+    webhookSecret=None
+    webhookQueue=None
+    webhookBatchSize=500 # responses per micro-batch
+    webhookBatchSeconds=2 # most time a response waits for its micro-batch
+    webhookPollInterval=3600 # seconds between gap filling polls of each form
+    lastReconciled=None
+    reconciledAt=None
+
+    # Aggregates
+    npsDaily=True # keep nps_daily_counts table up to date, if it exists
+    touchedDays=None # (form, day) buckets changed by this sync
+
+    # Entities synced to DB, in foreign key order
+    entities=[
+        {'df': 'forms',     'temp': 'forms_temp',      'table': 'forms'},
+        {'df': 'formItems', 'temp': 'form_items_temp', 'table': 'form_items'},
+        {'df': 'responses', 'temp': 'responses_temp',  'table': 'responses'},
+        {'df': 'answers',   'temp': 'answers_temp',    'table': 'answers'}
+    ]
+
+    # Bulk load methods per SQLAlchemy dialect; others get multi-row INSERTs
+    bulkLoaders={
+        'mysql':      'loadDataInfile',
+        'postgresql': 'loadCopy'
+    }
+    tablePrefix=''
+
+    # Concurrency
+    workers=1 # number of forms extracted in parallel; 1 means serial
+    streaming=False # load each page of responses while next pages are fetched
+    streamQueueSize=4 # pages
+    checkpoint=None
+    cache=None
+    replay=False
+    
+    # Workspace IDs to sync forms from; None for all forms of the account
+    workspaceFilter=None
+
+    # DataFrames for updated tables of entities to be synced
+    workspaces=None
+    forms=None
+    formItems=None
+    responses=None
+    answers=None
+    newestLanded=None
+
+    # This column order (and names) must match the respective table in the database
+    responseColumns=['id', 'form', 'ip_address', 'landed', 'submitted', 'agent', 'referer']
+    answerColumns=['id', 'form', 'response', 'sequence', 'field', 'data_type_hint', 'answer']
+    
+    # In memory representation of transformed responses
+    compactFrames=True
+    compactColumns={
+        'responses': {
+            'category': ['form','agent'],
+            'integer':  {},
+            'string':   ['ip_address','referer']
+        },
+        'answers': {
+            'category': ['form','response','field','data_type_hint'],
+            'integer':  {'sequence': 'int32'},
+            'string':   ['answer']
+        }
+    }
+
+    # Logging
+    response=None
+    logger=None
+    counters=None
+
+    # IDs of hidden fields and answers
+    ids=None
+    idDigest='shake_256' # 'blake2b' is faster, but changes all IDs; for new databases only
+    idKey=None # secret for keyed blake2b IDs
+    idMemoSize=65536 # IDs
+
+    # Instrumentation
+    metrics=None
+    metricsLogger=None
+    metricsFile=None # Prometheus textfile written after each sync
+
+    # Debug stuff
+    debugForms=['ARqhAx', 'KPbhd6'] #,'APiACy','YRyBYh']
+    
+    def __init__(self,token=None,dburl=None,restart=False,dbupdate=True,tableprefix=None,workers=None,dbconnections=None,dbchunkbytes=None,dbchunkseconds=None,streaming=None,restartforms=None,checkpoint=None,cache=None,replay=False,iddigest=None,idkey=None,metricsfile=None,reconcile=None,sink=None,workspaces=None,pollmin=None,pollmax=None,webhookport=None,webhooksecret=None):
+        self.token=token
+        self.dbURL=dburl
+
+        if tableprefix:
+            self.tablePrefix=tableprefix
+
+        if workers:
+            self.workers=max(1,int(workers))
+
+        if dbconnections:
+            self.dbConnections=max(1,int(dbconnections))
+
+        if dbchunkbytes:
+            self.dbChunkBytes=int(dbchunkbytes)
+
+        if dbchunkseconds:
+            self.dbChunkSeconds=float(dbchunkseconds)
+
+        self.dbChunkSizers={}
+        self.dbChunkSizersLock=threading.Lock()
+
+        if streaming is not None:
+            self.streaming=streaming
+
+        if reconcile:
+            self.reconcileDays=float(reconcile)
+
+        if workspaces:
+            self.workspaceFilter=list(workspaces)
+
+        if pollmin:
+            self.pollMinInterval=float(pollmin)
+
+        if pollmax:
+            self.pollMaxInterval=float(pollmax)
+
+        self.stopping=threading.Event()
+        self.writeLock=threading.Lock()
+
+        if webhookport is not None:
+            self.webhookPort=int(webhookport)
+
+        if webhooksecret:
+            self.webhookSecret=webhooksecret
+
+        if self.webhookPort is not None and not self.webhookSecret:
+            # Anyone reaching the port could write responses
+            raise ValueError('Webhooks need a webhook secret to check their signature')
+
+        if sink:
+            if not sink.startswith('parquet://'):
+                raise ValueError('Unknown sink «{}»; only parquet://path is supported'.format(sink))
+
+            self.sink=ParquetSink(sink[len('parquet://'):])
+
+        self.sinkPending={}
+        self.sinkLock=threading.Lock()
+        self.stagingUsed={}
+
+        if checkpoint:
+            self.checkpoint=Checkpoint(checkpoint)
+
+        if cache:
+            self.cache=PageCache(cache)
+
+        if iddigest:
+            self.idDigest=iddigest
+
+        if idkey:
+            self.idKey=idkey
+
+        self.ids=IDMaker(self.idDigest,self.idKey,memo=self.idMemoSize)
+
+        if replay:
+            if not self.cache:
+                raise ValueError('Replay needs a page cache')
+
+            # Rebuild everything that is in cache, regardless of last sync
+            self.replay=True
+            restart=True
+        
+        if __name__ == '__main__':
+            self.logger=logging.getLogger('TypeformETL.TypeformETL')
+        else:
+            self.logger=logging.getLogger(__name__ + '.TypeformETL')
+
+        # JSON lines with metrics of each sync, to be routed apart if needed
+        self.metricsLogger=logging.getLogger(self.logger.name + '.metrics')
+
+        if metricsfile:
+            self.metricsFile=metricsfile
+
+        self.typeformHeader={'Authorization': f'Bearer {self.token}'}
+        
+        self.restart=restart
+        self.restartForms=list(restartforms) if restartforms else []
+        self.dbUpdate=dbupdate
+
+        self.metrics=Metrics()
+        self.counters=self.metrics.totals
+
+        self.watermarks={}
+        self.storedWatermarks={}
+        self.watermarksLock=threading.Lock()
+
+        self.touchedDays=set()
+
+        self.__prepareSession()
+
+
+
+    def __prepareSession(self):
+        # One keep-alive session with a connection pool big enough for all workers
+        self.session=requests.Session()
+        self.session.headers.update(self.typeformHeader)
+
+        adapter=HTTPAdapter(pool_connections=1, pool_maxsize=max(10,self.workers))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        if self.apiRateLimit:
+            self.rateLimiter=TokenBucket(self.apiRateLimit,self.apiRateBurst)
+
+
+
+    def count(self,counter,value=1,**labels):
+        # Add to a counter, in total and per form, table, stage or endpoint
+        self.metrics.count(counter,value,**labels)
+
+
+
+    def retryWait(self,attempt,response=None):
+        # Seconds to wait before retry number «attempt»: whatever the server asks
+        # for in Retry-After, or exponential backoff with some jitter
+        if response is not None and 'Retry-After' in response.headers:
+            retryAfter=response.headers['Retry-After']
+            try:
+                return max(0,float(retryAfter))
+            except ValueError:
+                pass
+
+            try:
+                retryAt=parsedate_to_datetime(retryAfter)
+                return max(0,(retryAt - datetime.now(retryAt.tzinfo)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+        return self.apiBackoff * 2**attempt * (1 + random.random()/2)
+
+
+
+    def apiGet(self,url,cacheKey=None):
+        # GET an API URL and return the decoded JSON. With a page cache, the
+        # page is also stored in it under «cacheKey»; when replaying, it is
+        # taken from there instead of the network.
+        # Cache keys are (endpoint, form, …), which also label metrics
+        labels={}
+        if cacheKey:
+            labels['endpoint']=cacheKey[0]
+            if cacheKey[0] not in ('forms','workspaces'):
+                labels['form']=cacheKey[1]
+
+        if self.cache and cacheKey:
+            if self.replay:
+                return self.cache.load(*cacheKey)
+
+            page=self.apiRequest(url,**labels)
+            self.cache.store(page,*cacheKey)
+            return page
+
+        return self.apiRequest(url,**labels)
+
+
+
+    def apiRequest(self,url,endpoint='other',form=None):
+        # GET an API URL through the shared session, under the client-side rate
+        # limit, retrying connection errors, HTTP 429 and 5xx with backoff.
+        # Returns the decoded JSON.
+        attempt=0
+        while True:
+            if self.rateLimiter:
+                self.count('throttleSeconds',self.rateLimiter.take(),endpoint=endpoint,form=form)
+
+            response=None
+            try:
+                start=time.monotonic()
+                response=self.session.get(url,timeout=self.apiTimeout)
+                elapsed=time.monotonic()-start
+
+                self.count('apiRequests',endpoint=endpoint,form=form)
+                self.count('apiSeconds',elapsed,endpoint=endpoint,form=form)
+                self.count('apiBytes',len(response.content),endpoint=endpoint,form=form)
+                self.metrics.observe(endpoint,elapsed)
+
+                if response.status_code not in self.apiRetryStatus:
+                    response.raise_for_status()
+                    return response.json()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.apiRetries:
+                    raise
+
+            if attempt >= self.apiRetries:
+                response.raise_for_status()
+
+            wait=self.retryWait(attempt,response)
+
+            self.logger.warning('Retrying {url} in {wait:.1f}s ({reason}).'.format(
+                url=url,
+                wait=wait,
+                reason=('HTTP {}'.format(response.status_code) if response is not None else 'connection error')
+            ))
+
+            self.count('apiRetries',endpoint=endpoint,form=form)
+            self.count('retrySeconds',wait,endpoint=endpoint,form=form)
+            time.sleep(wait)
+            attempt += 1
+
+        
+
+    def __connectDB(self):
+        try:
+            connectArgs={}
+            if sqlalchemy.engine.url.make_url(self.dbURL).get_backend_name() == 'mysql':
+                # Allow LOAD DATA LOCAL INFILE on client side
+                connectArgs['local_infile']=1
+
+            engineArgs={}
+            if sqlalchemy.engine.url.make_url(self.dbURL).get_backend_name() != 'sqlite':
+                # Parallel loaders plus the sync transaction
+                engineArgs['pool_size']=max(5,self.dbConnections+1)
+
+            self.db=sqlalchemy.create_engine(self.dbURL, encoding='utf8', connect_args=connectArgs, **engineArgs)
+        except sqlalchemy.exc.SQLAlchemyError as error:
+            self.logger.error('Can’t connect to DB.', exc_info=True)
+            raise error
+
+            
+            
+            
+            
+    def __getLastSync(self):
+        # Per form sync watermarks: for each form, newest submitted time of
+        # completed responses and newest landed time of partial responses
+        # already in DB. Responses of each form are requested since its own
+        # watermarks, so a form with no watermark is synced from the start.
+        self.watermarks={}
+
+        stateTable=self.prepareSyncState()
+        self.checkIDDigest()
+
+        if self.restart:
+            self.storedWatermarks = {}
+            self.storedForms = None
+
+            if self.replay:
+                # Definitions of forms skipped as unchanged when they were
+                # cached can only come from DB
+                self.storedForms=pd.read_sql(f"select id, workspace, updated from {self.tablePrefix}forms;", self.db, index_col='id')
+
+            return
+
+        if stateTable:
+            state=pd.read_sql(f"select form, completed, since from {self.tablePrefix}sync_state;", self.db)
+        else:
+            state=pd.DataFrame(columns=['form','completed','since'])
+        for row in state.itertuples():
+            if pd.notna(row.since):
+                self.watermarks[(row.form,bool(row.completed))]=pd.Timestamp(row.since).to_pydatetime()
+
+        seeded=False
+        if state.shape[0] == 0:
+            # Database synced by a version without per form state, which only
+            # recorded typeform_last: seed state from what we have in the
+            # responses table, but never past typeform_last, since newer
+            # responses can only come from an interrupted sync. No
+            # typeform_last means a new database, or a first sync that didn't
+            # finish, to be synced from the start.
+            last=pd.read_sql(f"select value from {self.tablePrefix}options where name='typeform_last';", self.db)['value']
+            last=pd.Timestamp(last.iloc[0]).to_pydatetime() if last.shape[0] and pd.notna(last.iloc[0]) else None
+
+            if last is not None:
+                lasts=pd.read_sql(f"select form, max(landed) as landed, max(submitted) as submitted from {self.tablePrefix}responses group by form;", self.db)
+                for row in lasts.itertuples():
+                    if pd.notna(row.submitted):
+                        self.watermarks[(row.form,True)]=min(pd.Timestamp(row.submitted).to_pydatetime(),last)
+                    if pd.notna(row.landed):
+                        self.watermarks[(row.form,False)]=min(pd.Timestamp(row.landed).to_pydatetime(),last)
+
+                seeded=True
+                self.logger.info('Seeded sync state of {} forms from typeform_last {}'.format(lasts.shape[0],last))
+
+        # What we know about forms, to skip definitions that didn't change
+        self.storedForms=pd.read_sql(f"select id, workspace, updated from {self.tablePrefix}forms;", self.db, index_col='id')
+
+        # Forms to be synced again from scratch
+        for form in self.restartForms:
+            self.logger.info('Restarting sync of form «{}»'.format(form))
+            self.watermarks.pop((form,True),None)
+            self.watermarks.pop((form,False),None)
+        self.storedForms=self.storedForms.drop(self.restartForms,errors='ignore')
+
+        # Seeded watermarks are not in DB yet: all of them are saved by this
+        # sync, not only the ones that move
+        self.storedWatermarks={} if seeded else dict(self.watermarks)
+
+
+
+    def checkIDDigest(self):
+        # IDs made by another digest, or key, would duplicate every answer
+        # and hidden item already in DB. The first sync records the digest in
+        # options; databases filled before that used shake_256.
+        options=self.tablePrefix + 'options'
+        recorded=pd.read_sql(f"select value from {options} where name='id_digest';", self.db)['value']
+
+        if recorded.shape[0] > 0:
+            stored=recorded.iloc[0]
+        elif pd.read_sql(f"select count(*) as n from (select id from {self.tablePrefix}answers limit 1) a;", self.db)['n'].iloc[0] > 0:
+            stored=IDMaker('shake_256').fingerprint()
+        else:
+            stored=None
+
+        if stored is not None and stored != self.ids.fingerprint():
+            raise ValueError(
+                'Database has IDs made with {}, not with this --id-digest {}{}; switching would duplicate all answers'.format(
+                    stored.split(':')[0],
+                    self.idDigest,
+                    ' and --id-key' if self.idKey else ''
+                )
+            )
+
+        if recorded.shape[0] == 0 and self.dbUpdate:
+            with self.db.begin() as con:
+                con.execute(
+                    sqlalchemy.text(f"INSERT INTO {options} (name, value, comment) VALUES ('id_digest', :value, 'Digest of answer and hidden item IDs')"),
+                    {'value': self.ids.fingerprint()}
+                )
+
+
+
+    def prepareSyncState(self):
+        # Make sure the sync_state table exists, as databases created before
+        # 0.7 don't have it, and tell if it does. Created here, outside of the
+        # load transaction, because DDL commits it on MySQL; not on dry runs.
+        table=self.tablePrefix + 'sync_state'
+
+        if sqlalchemy.inspect(self.db).has_table(table):
+            return True
+
+        if not self.dbUpdate:
+            return False
+
+        if self.db.dialect.name == 'mysql':
+            # Same as examples/datamodel.sql
+            ddl=f"""
+                CREATE TABLE {table} (
+                  form varchar(8) CHARACTER SET ascii NOT NULL,
+                  completed tinyint(1) NOT NULL,
+                  since timestamp NULL DEFAULT NULL,
+                  PRIMARY KEY (form, completed)
+                ) DEFAULT CHARSET=utf8
+            """
+        else:
+            ddl=f"""
+                CREATE TABLE {table} (
+                  form varchar(8) NOT NULL,
+                  completed smallint NOT NULL,
+                  since timestamp NULL DEFAULT NULL,
+                  PRIMARY KEY (form, completed)
+                )
+            """
+
+        with self.db.begin() as con:
+            con.execute(sqlalchemy.text(ddl))
+
+        self.logger.info('Created «{}» table'.format(table))
+
+        return True
+
+
+
+    def since(self,form,completed):
+        # Watermark of a form: responses will be requested since this time
+        with self.watermarksLock:
+            return self.watermarks.get((form,completed),datetime(1970,1,1))
+
+
+
+    def advanceWatermark(self,form,completed,items):
+        # Move watermark of a form forward to the newest response of a page
+        times=[i['submitted_at' if completed else 'landed_at'] for i in items if i.get('submitted_at' if completed else 'landed_at')]
+
+        if len(times) == 0:
+            return
+
+        self.raiseWatermark(form,completed,self.parseTimestamps([max(times)])[0].to_pydatetime())
+
+
+
+    def raiseWatermark(self,form,completed,newest):
+        with self.watermarksLock:
+            if (form,completed) not in self.watermarks or newest > self.watermarks[(form,completed)]:
+                self.watermarks[(form,completed)]=newest
+
+
+
+    def __setWatermarks(self,con):
+        # Persist watermarks that changed in this sync
+        changed=[
+            {'form': form, 'completed': int(completed), 'since': since}
+            for (form,completed),since in self.watermarks.items()
+            if self.storedWatermarks.get((form,completed)) != since
+        ]
+
+        if len(changed) == 0:
+            return
+
+        con.execute(
+            sqlalchemy.text(f"DELETE FROM {self.tablePrefix}sync_state WHERE form=:form AND completed=:completed"),
+            changed
+        )
+        con.execute(
+            sqlalchemy.text(f"INSERT INTO {self.tablePrefix}sync_state (form, completed, since) VALUES (:form, :completed, :since)"),
+            changed
+        )
+
+        self.storedWatermarks=dict(self.watermarks)
+
+        self.logger.debug('Advanced {} sync watermarks'.format(len(changed)))
+
+
+
+
+        
+    def __setLastSync(self,con):
+        self.__setWatermarks(con)
+
+        lastData=self.newestLanded
+
+        # Set last sync date
+        if pd.notna(lastData):
+            con.execute(
+                sqlalchemy.text(f"UPDATE {self.tablePrefix}options SET value=:last WHERE name='typeform_last'"),
+                {'last': str(lastData)}
+            )
+
+        # Update the sync log
+        log={
+            'timestamp':         datetime.utcnow().replace(microsecond=0),
+            'version':           __version__,
+            'forms':             self.forms.shape[0],
+            'form_items':        self.formItems.shape[0],
+            'responses':         self.counters['responses'],
+            'answers':           self.counters['answers'],
+            'duration':          time.time()-self.metrics.started,
+            'api_requests':      self.counters['apiRequests'],
+            'api_bytes':         self.counters['apiBytes'],
+            'api_seconds':       self.counters['apiSeconds'],
+            'api_retries':       self.counters['apiRetries'],
+            'api_wait':          self.counters['retrySeconds'] + self.counters['throttleSeconds'],
+            'transform_seconds': self.counters['transformSeconds'],
+            'db_seconds':        self.counters['dbSeconds'],
+            # Per form detail grows with the account, it stays in the metrics
+            # log and Prometheus file
+            'metrics':           json.dumps({k: v for k,v in self.metrics.snapshot().items() if k != 'form'},default=str)
+        }
+
+        # Synclog tables created before 0.7 lack the metrics columns
+        columns=[c['name'] for c in sqlalchemy.inspect(con).get_columns(self.tablePrefix + 'synclog')]
+        log={k: v for k,v in log.items() if k in columns}
+
+        con.execute(
+            sqlalchemy.text("INSERT INTO {table} ({columns}) VALUES ({values})".format(
+                table=self.tablePrefix + 'synclog',
+                columns=','.join(log.keys()),
+                values=','.join(':' + k for k in log.keys())
+            )),
+            log
+        )
+        
+
+
+    def getAllPages(self,url,cacheKey):
+        # Items of all pages of a paginated list, from «url» with a {page}
+        # placeholder. First page tells how many pages there are; the others
+        # are fetched in parallel, in self.listWorkers threads, and items are
+        # returned in page order.
+        def getPage(page):
+            try:
+                return self.apiGet(url.format(page=page),cacheKey + ('page{:06d}'.format(page),))
+            except:
+                self.logger.error('Error trying to get page {} of {}.'.format(page,url), exc_info=True)
+                raise
+
+        self.response=getPage(1)
+        pages=[self.response]
+
+        rest=list(range(2,(self.response.get('page_count') or 1)+1))
+
+        if self.listWorkers > 1 and len(rest) > 1:
+            with ThreadPoolExecutor(max_workers=self.listWorkers) as executor:
+                pages.extend(executor.map(getPage,rest))
+        else:
+            pages.extend(getPage(page) for page in rest)
+
+        return [item for page in pages for item in page.get('items') or []]
+
+
+
+    def getWorkspaces(self):
+        # All workspaces of the account, or only the ones in
+        # self.workspaceFilter
+        workspaceColumns=['id', 'url', 'title']
+
+        self.logger.debug('Requesting workspaces…')
+
+        workspaces=[
+            {
+                'id':    w['id'],
+                'url':   w['self']['href'],
+                'title': w['name']
+            }
+            for w in self.getAllPages(self.workspaceListURL,('workspaces',))
+        ]
+
+        self.workspaces=pd.DataFrame(workspaces,columns=workspaceColumns).drop_duplicates(subset='id').set_index('id')
+
+        if self.workspaceFilter:
+            unknown=sorted(set(self.workspaceFilter) - set(self.workspaces.index))
+            if unknown:
+                self.logger.warning('Unknown workspaces: {}'.format(', '.join(unknown)))
+
+            self.workspaces=self.workspaces[self.workspaces.index.isin(self.workspaceFilter)]
+
+        self.count('workspaces',self.workspaces.shape[0])
+
+
+
+    def getForms(self):
+        # This column order (and names) must match the respective table in the database
+        formColumns=['id', 'workspace', 'updated', 'url', 'title','description']
+        
+        self.logger.debug('Requesting forms…')
+
+        if self.workspaceFilter:
+            # Forms of selected workspaces only, listed in parallel
+            self.getWorkspaces()
+
+            def getFormsOfWorkspace(workspace):
+                return [
+                    dict(f,workspace=workspace)
+                    for f in self.getAllPages(
+                        self.formListURL + '&workspace_id=' + workspace,
+                        ('forms',workspace)
+                    )
+                ]
+
+            with ThreadPoolExecutor(max_workers=max(1,self.listWorkers)) as executor:
+                items=[f for fs in executor.map(getFormsOfWorkspace,sorted(self.workspaces.index)) for f in fs]
+        else:
+            items=self.getAllPages(self.formListURL,('forms',))
+
+        forms=[]
+
+        for f in items:
+#             if f['id'] not in self.debugForms:
+#                 continue
+
+            form={}
+            form['id']        =f['id']
+            form['workspace'] =f.get('workspace')
+            form['url']       =f['_links']['display']
+            form['title']     =f['title']
+#             form['ref']       =f['ref']
+            form['updated']   =self.parseTimestamp(f['last_updated_at'])
+
+            forms.append(form)
+
+        self.forms=pd.DataFrame(columns=formColumns)
+        self.forms=self.forms.append(forms)
+
+        # Forms created while listing may shift others to the next page
+        self.forms.drop_duplicates(subset='id',inplace=True)
+        self.forms.set_index('id',inplace=True)
+
+        self.logger.debug('Listed {} forms'.format(self.forms.shape[0]))
+
+        del forms
+
+        
+        
+    def forEachForm(self,function,forms=None):
+        # Run function(form) for every form (or only «forms»), in parallel when
+        # self.workers > 1. Results are returned in the sorted order of form IDs,
+        # exactly as the serial path would produce them, so DataFrames built from
+        # them don't depend on the number of workers.
+        
+#         forms=self.debugForms
+        if forms is None:
+            forms=self.forms.index
+        forms=sorted(forms)
+
+        if self.workers > 1 and len(forms) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return list(executor.map(function,forms))
+        else:
+            return [function(form) for form in forms]
+
+
+
+    def formsToPoll(self):
+        # Forms to get responses of: all of them, or in daemon mode only the
+        # ones due by their schedule
+        if self.scheduler is None:
+            return None
+
+        self.pollForms=self.scheduler.due(self.forms.index,time.time())
+
+        self.logger.info('Polling {} of {} forms'.format(len(self.pollForms),self.forms.shape[0]))
+
+        return self.pollForms
+
+
+
+    def changedForms(self):
+        # Forms whose definition changed since last sync, from their
+        # 'updated' time compared to what is stored in DB, or all of them
+        # if we know nothing
+        if self.replay:
+            # The ones in cache; the others were unchanged when cached
+            return [form for form in self.forms.index if self.cache.has('definitions',form)]
+
+        if self.storedForms is None:
+            return list(self.forms.index)
+
+        stored=self.storedForms['updated'].reindex(self.forms.index)
+        changed=stored.isna() | (pd.to_datetime(self.forms['updated']) > pd.to_datetime(stored))
+
+        return list(self.forms.index[changed])
+
+
+
+    def getFormItemsOfForm(self,form):
+        field  = {}
+        fields = []
+
+        response=None
+        field_index=0
+        try:
+            response=self.apiGet(self.formItemsURL.format(id=form),('definitions',form))
+            self.logger.debug('Requested: ' + self.formItemsURL.format(id=form))
+        except requests.exceptions.RequestException as error:
+            self.logger.error('Error trying to get form items', exc_info=True)
+            raise error
+
+        self.response=response
+
+        # Get form's workspace ID from last 6 chars on workspace URL
+        workspace = response['workspace']['href'][-6:]
+
+        if 'hidden' in response:
+            for f in response['hidden']:
+                field = {}
+                field['form']      = form
+                field['title']     = f
+                field['name']      = f
+                field['type']      = 'hidden'
+                field['position']  = field_index
+
+                field['id']        = self.makeID('{}hidden{}'.format(form,f))
+
+                fields.append(field)
+                field_index += 1
+                del field
+
+        if 'fields' in response:
+            for f in response['fields']:                
+                field = {}
+                field['form']               = form
+                field['id']                 = f['id']
+                field['title']              = f['title']
+                field['name']               = f['ref']
+                field['type']               = f['type']
+                field['position']           = field_index
+                
+                if 'properties' in f and 'description' in f['properties']:
+                    field['description']    = f['properties']['description']
+
+                fields.append(field)
+                field_index += 1
+                del field
+            
+                # Handle sub fields (under group fields)
+                if 'properties' in f and 'fields' in f['properties']:
+                    for subf in f['properties']['fields']:
+                        field = {}
+                        field['form']               = form
+                        field['parent_id']          = f['id']
+                        field['id']                 = subf['id']
+                        field['title']              = subf['title']
+                        field['name']               = subf['ref']
+                        field['parent_name']        = f['ref']
+                        field['type']               = subf['type']
+                        field['position']           = field_index
+
+                        if 'properties' in subf and 'description' in subf['properties']:
+                            field['description']    = subf['properties']['description']
+
+                        fields.append(field)
+                        field_index += 1
+                        del field
+
+        return (workspace,fields)
+
+
+
+    def getFormItems(self):
+        fields = []
+
+        # This column order (and names) must match the respective table in the database
+        formItemsColumns=['id','parent_id','form','position','name','parent_name','type','title','description']
+
+        self.logger.debug('Requesting form items…')
+
+        forms=sorted(self.changedForms())
+        for form,(workspace,formFields) in zip(forms,self.forEachForm(self.getFormItemsOfForm,forms)):
+            self.forms.at[form,'workspace'] = workspace
+            fields.extend(formFields)
+
+        # Definitions of unchanged forms are already in DB as they are
+        unchanged=self.forms.index.difference(forms)
+
+        missing=unchanged.difference(self.storedForms.index) if self.storedForms is not None else unchanged
+        if len(missing) > 0:
+            raise ValueError('Definitions of forms {} are neither in cache nor in DB'.format(', '.join(missing)))
+
+        if len(unchanged) > 0:
+            self.forms.loc[unchanged,'workspace'] = self.storedForms.loc[unchanged,'workspace']
+        self.count('formsSkipped',len(unchanged))
+
+        self.logger.debug('Skipped definitions of {} unchanged forms'.format(len(unchanged)))
+        
+        self.formItems=pd.DataFrame(columns=formItemsColumns)
+        self.formItems=self.formItems.append(fields)
+        self.formItems.set_index('id',inplace=True)
+
+        del fields
+        
+
+        
+    def iterResponsePages(self,form,completed=None,before=None):
+        # Generator of raw pages of responses for a form, as lists of response
+        # items from the API, for submitted and not submitted responses (or
+        # only the «completed» ones), optionally starting after token «before»
+
+        if self.replay:
+            yield from self.iterCachedResponsePages(form,completed)
+            return
+
+        for completed in ([True,False] if completed is None else [completed]):
+        
+            since=self.since(form,completed).isoformat()
+        
+            # No need to probe how many responses we have: first page
+            # tells, and is already the first set of responses
+            self.count('probesAvoided')
+
+            lastToken=before
+            page=1
+            while True:
+                try:                    
+                    url=self.respListURL.format(
+                        id=form, psize=self.respPageSize,
+                        page=page, completed=str(completed).lower(),
+                        since=since
+                    )
+
+                    if lastToken:
+                        # Append last token we have for this page
+                        url += f'&before={lastToken}'
+
+                    
+                    responseSet=self.apiGet(url,(
+                        'responses',form,
+                        'completed' if completed else 'partial',
+                        since.replace(':','-'),
+                        '{:06d}.{}'.format(page,lastToken or 'first')
+                    ))
+                    
+#                     self.logger.debug(responseSet)
+
+                    self.logger.debug('Requesting responses for form «{}», submitted={}: {} answers'.format(form,completed,responseSet.get('total_items')))
+                    self.logger.debug(f'Requesting from: {url}')
+
+                except requests.exceptions.RequestException as error:
+                    self.logger.error('Error trying to get response details for form «{}»'.format(form), exc_info=True)
+                    raise error
+
+                self.response=responseSet
+
+                items=responseSet.get('items') or []
+
+                if len(items) > 0:
+                    lastToken=items[-1]['token'] # generally same as 'response_id', but just to follow docs
+                    self.advanceWatermark(form,completed,items)
+
+                    yield items
+
+                # page_count is the number of pages left after the 'before' token
+                if len(items) < self.respPageSize or responseSet.get('page_count',0) <= 1:
+                    break
+
+                page+=1
+
+
+
+    def iterCachedResponsePages(self,form,completed=None):
+        # Same as iterResponsePages(), from all pages of a form in the page
+        # cache, of all syncs. A response cached by more than one sync is
+        # taken as submitted if any sync got it submitted, else as it was in
+        # the most recently written page by its cacheSequence, whatever its
+        # state or the «since» of its sync (a --restart sync caches under
+        # 1970-01-01). Pages cached before sequences go first.
+        items={}
+        for state in ['completed','partial']:
+            for since in self.cache.keys('responses',form,state):
+                for page in self.cache.keys('responses',form,state,since):
+                    cached=self.cache.load('responses',form,state,since,page)
+                    written=cached.get('cacheSequence',[0,0])
+
+                    for i in cached.get('items') or []:
+                        version=(i.get('submitted_at') is not None,written)
+                        if i['response_id'] not in items or version >= items[i['response_id']][0]:
+                            items[i['response_id']]=(version,i)
+
+        for completed in ([True,False] if completed is None else [completed]):
+            selected=[i for (submitted,written),i in items.values() if submitted == completed]
+
+            for start in range(0,len(selected),self.respPageSize):
+                page=selected[start:start+self.respPageSize]
+                self.advanceWatermark(form,completed,page)
+
+                yield page
+
+
+
+    def formatAnswer(self,field):
+        # The answer of a regular field as it is stored in DB: choice and
+        # multichoice answers as JSON, everything else as a plain string
+        value=field[field['type']]
+
+        # Handle multichoice fields
+        if field['type'] == 'choices' or field['type'] == 'choice':
+            answer = {}
+            
+            if 'labels' in value or 'label' in value:
+                if field['type'] == 'choices':
+                    # Multi-choice
+                    answer = dict(zip(value['ids'],value['labels']))
+                else:
+                    # Single choice
+                    answer[value['id']] = str(value['label'])
+                    
+            if 'other' in value:
+                answer['other'] = value['other']
+
+            # convert to compressed Unicode JSON to store in DB
+            return json.dumps(
+                answer,
+                ensure_ascii=False,
+                separators=(',', ':')
+            )
+        else:
+            # Default: just get the content, always as a string
+            return str(value)
+
+
+
+    def parseTimestamps(self,timestamps):
+        # Vectorized parse of a list of API timestamps into naive UTC datetimes;
+        # None becomes NaT.
+        # Typeform always sends «YYYY-MM-DDTHH:MM:SSZ», which numpy parses in C
+        # once the «Z» is dropped. Anything else goes through dateutil.
+        fast=[]
+        slow={}
+
+        for k,t in enumerate(timestamps):
+            if not isinstance(t,str):
+                fast.append('NaT')
+            elif len(t) == 20 and t[10] == 'T' and t[19] == 'Z':
+                fast.append(t[:19])
+            else:
+                fast.append('NaT')
+                slow[k]=t
+
+        try:
+            parsed=np.array(fast,dtype='datetime64[us]')
+        except ValueError:
+            # Right shape, wrong content somewhere; let dateutil sort it out
+            parsed=np.full(len(fast),np.datetime64('NaT'),dtype='datetime64[us]')
+            slow={k: t for k,t in enumerate(timestamps) if isinstance(t,str)}
+
+        for k,t in slow.items():
+            parsed[k]=np.datetime64(self.parseTimestampSlow(t),'us')
+
+        return pd.DatetimeIndex(parsed.astype('datetime64[ns]'))
+
+
+
+    def parseTimestamp(self,timestamp):
+        return self.parseTimestamps([timestamp])[0].to_pydatetime()
+
+
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def parseTimestampSlow(timestamp):
+        # Naive UTC datetime of any timestamp dateutil understands
+        parsed=dateparser.parse(timestamp)
+
+        if parsed.tzinfo:
+            parsed=parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+        return parsed
+
+
+
+    def transformResponses(self,form,items):
+        # Transform a page of response items of a form, as returned by the API,
+        # into a pair of (responses, answers) DataFrames.
+        # Items are flattened in one pass into column lists; then timestamps
+        # are parsed and IDs are computed in batch, for the whole page at once.
+
+        responses    = {c: [] for c in self.responseColumns}
+        answers      = {c: [] for c in self.answerColumns}
+        answerKeys   = []
+        hiddenFields = {}
+
+        for i in items:
+#             self.logger.debug(f"working on: {i}")
+
+            response=i['response_id']
+
+            responses['id'].append(response)
+            responses['ip_address'].append(i['metadata'].get('network_id',math.nan))
+            responses['landed'].append(i['landed_at'])
+
+            # apparently became an optional parameter in 2020-03-02
+            responses['submitted'].append(i.get('submitted_at'))
+
+            responses['agent'].append(i['metadata']['user_agent'])
+            responses['referer'].append(i['metadata']['referer'])
+
+            seq=0
+
+            # Handle all hidden fields of response
+            for t in ['hidden']: #,'calculated']:
+                if t in i:
+                    for field,value in i[t].items():
+                        if field not in hiddenFields:
+                            hiddenFields[field]=self.makeID('{}{}{}'.format(form,t,field))
+
+                        answerKeys.append('{}{}{}'.format(form,response,field))
+                        answers['response'].append(response)
+                        answers['sequence'].append(seq)
+                        answers['field'].append(hiddenFields[field])
+                        answers['data_type_hint'].append(t)
+                        answers['answer'].append(value)
+                        seq+=1
+
+
+            # Handle all regular fields of response
+            if 'answers' in i:
+                # apparently content into 'ansewrs' became optional in 2020-03-02
+                if i['answers'] is None:
+                    # Flag submitted as Null if there are no answers
+                    responses['submitted'][-1] = None
+                else:
+                    for field in i['answers']:
+                        answerKeys.append('{}{}{}'.format(form,response,field['field']['id']))
+                        answers['response'].append(response)
+                        answers['sequence'].append(seq)
+                        answers['field'].append(field['field']['id'])
+                        answers['data_type_hint'].append(field['type'])
+                        answers['answer'].append(self.formatAnswer(field))
+                        seq+=1
+
+        responses['form']  = [form]*len(responses['id'])
+        responses['landed']    = self.parseTimestamps(responses['landed'])
+        responses['submitted'] = self.parseTimestamps(responses['submitted'])
+
+        answers['id']   = self.makeIDs(answerKeys)
+        answers['form'] = [form]*len(answerKeys)
+
+        return (
+            self.compact(pd.DataFrame(responses,columns=self.responseColumns).set_index('id'),'responses'),
+            self.compact(pd.DataFrame(answers,columns=self.answerColumns).set_index('id'),'answers')
+        )
+
+
+
+    def compact(self,df,entity):
+        # Same DataFrame with less memory: values repeated on many rows as
+        # categoricals, and IDs and free text as Arrow strings, if pyarrow is
+        # installed
+        if not self.compactFrames:
+            return df
+
+        measure=self.logger.isEnabledFor(logging.DEBUG)
+        if measure:
+            self.count('framesPlainBytes',int(df.memory_usage(deep=True).sum()),entity=entity)
+
+        columns=self.compactColumns[entity]
+
+        for c in columns['category']:
+            # Sorted categories, so sorting by them is the same as by strings
+            df[c]=pd.Categorical(df[c])
+
+        for c in columns['integer']:
+            df[c]=df[c].astype(columns['integer'][c])
+
+        if self.arrowStrings():
+            for c in columns['string']:
+                df[c]=df[c].astype('string[pyarrow]')
+
+            df.index=df.index.astype('string[pyarrow]')
+
+        if measure:
+            self.count('framesCompactBytes',int(df.memory_usage(deep=True).sum()),entity=entity)
+
+        return df
+
+
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1)
+    def arrowStrings():
+        try:
+            import pyarrow
+            return True
+        except ImportError:
+            return False
+
+
+
+    def concatFrames(self,frames):
+        # pd.concat() of pages, keeping categorical columns as categoricals,
+        # which plain pd.concat() turns into objects when pages have different
+        # categories
+        categories={}
+        for c in frames[0].columns:
+            if isinstance(frames[0][c].dtype,pd.CategoricalDtype):
+                categories[c]=union_categoricals([f[c] for f in frames],sort_categories=True).categories
+
+        if categories:
+            frames=[f.assign(**{c: f[c].cat.set_categories(categories[c]) for c in categories}) for f in frames]
+
+        return pd.concat(frames)
+
+
+
+    def iterResponseFrames(self,form):
+        # Generator of (form, completed, token, responses, answers) for each page
+        # of responses of a form, transformed.
+        # With a checkpoint, pages of an interrupted run from the same
+        # watermarks are taken from it (or assumed in DB, when streaming) and
+        # fetching resumes after the last page it recorded.
+
+        for completed in [True,False]:
+            before=None
+            done=False
+            resumed=None
+
+            if self.checkpoint:
+                since=self.since(form,completed).isoformat()
+                state=self.checkpoint.resume(form,completed,since)
+
+                if state is None:
+                    self.checkpoint.start(form,completed,since)
+                else:
+                    self.logger.debug('Resuming form «{}», submitted={} after {} pages from checkpoint'.format(form,completed,state['pages']))
+                    self.count('pagesResumed',state['pages'])
+
+                    if state['watermark']:
+                        resumed=pd.Timestamp(state['watermark']).to_pydatetime()
+
+                    done=state['done']
+
+                    for responses,answers in self.checkpoint.frames(form,completed):
+                        yield (form,completed,state['before'],responses,answers)
+
+                    before=state['before']
+
+            if not done:
+                for items in self.iterResponsePages(form,completed,before):
+                    with self.metrics.timer('transformSeconds',form=form):
+                        responses,answers=self.transformResponses(form,items)
+
+                    self.count('responsesTransformed',responses.shape[0],form=form)
+                    self.count('answersTransformed',answers.shape[0],form=form)
+                    token=items[-1]['token']
+
+                    if self.checkpoint and not self.streaming:
+                        # When streaming, page is recorded only after it is in DB
+                        watermark=self.since(form,completed)
+                        self.checkpoint.page(form,completed,token,max(resumed,watermark) if resumed else watermark,(responses,answers))
+
+                    yield (form,completed,token,responses,answers)
+
+            if resumed:
+                # Only now, so pages above were requested since same time as before
+                self.raiseWatermark(form,completed,resumed)
+
+            if self.checkpoint and not self.streaming:
+                self.checkpoint.finish(form,completed)
+
+
+
+    def getResponsesOfForm(self,form):
+        # All (responses, answers) DataFrames of a form, one pair per page
+        with self.metrics.timer('extractSeconds',form=form):
+            return [(page[3],page[4]) for page in self.iterResponseFrames(form)]
+
+
+
+    def streamResponses(self):
+        # Generator of (form, completed, token, responses, answers), one per page
+        # of responses. Pages are fetched and transformed by background threads
+        # into a bounded queue, so network work overlaps with whatever the
+        # consumer does with each page, and memory stays bounded by
+        # self.streamQueueSize pages.
+
+        pages=queue.Queue(maxsize=self.streamQueueSize)
+        stop=threading.Event()
+        done=object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item,timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce(form):
+            for page in self.iterResponseFrames(form):
+                if stop.is_set():
+                    return
+                put(page)
+
+        def produceAll():
+            try:
+                self.forEachForm(produce,self.formsToPoll())
+            except BaseException as error:
+                put(error)
+            finally:
+                put(done)
+
+        producer=threading.Thread(target=produceAll,name='TypeformETL-producer',daemon=True)
+        producer.start()
+
+        try:
+            while True:
+                page=pages.get()
+
+                if page is done:
+                    break
+
+                if isinstance(page,BaseException):
+                    raise page
+
+                yield page
+        finally:
+            # Release producers in case consumer gave up
+            stop.set()
+
+
+
+    def getResponses(self):
+        pages = []
+
+        for formPages in self.forEachForm(self.getResponsesOfForm,self.formsToPoll()):
+            pages.extend(formPages)
+
+        self.responses=pd.DataFrame(columns=self.responseColumns).set_index('id')
+        self.answers=pd.DataFrame(columns=self.answerColumns).set_index('id')
+
+        if len(pages)>0:
+            self.responses=self.concatFrames([p[0] for p in pages])
+            self.answers=self.concatFrames([p[1] for p in pages])
+
+        del pages
+
+        self.logger.info('Responses and answers take {:.1f} MiB in memory'.format(
+            (self.responses.memory_usage(deep=True).sum() + self.answers.memory_usage(deep=True).sum())/2**20
+        ))
+
+        # Sort reponses by «landed» time
+        self.responses.sort_values(by='landed', inplace=True)
+#         self.logger.debug(self.responses)
+
+        # Sort answers by reponses’ «landed» time
+#         self.answers['response']=pd.Categorical(self.answers['response'],self.responses.sort_values(by='landed').index)
+        self.answers.sort_values(by='response', inplace=True)
+
+        self.count('responses',self.responses.shape[0])
+        self.count('answers',self.answers.shape[0])
+        self.newestLanded=self.responses['landed'].max()
+
+        self.touchDays(self.responses)
+
+
+
+    def listResponseIDs(self,form,since,field=None):
+        # Lightweight listing of all responses of a form landed since «since»,
+        # with answers reduced to one «field» (or all of them, if None).
+        # Returns {response ID: whether it was submitted}
+        listed={}
+        lastToken=None
+
+        while True:
+            url=self.respReconcileURL.format(id=form,since=since.isoformat(),psize=self.respPageSize)
+
+            if field:
+                url += f'&fields={field}'
+
+            if lastToken:
+                url += f'&before={lastToken}'
+
+            try:
+                responseSet=self.apiRequest(url,endpoint='reconcile',form=form)
+            except requests.exceptions.RequestException as error:
+                self.logger.error('Error trying to list responses of form «{}»'.format(form), exc_info=True)
+                raise error
+
+            items=responseSet.get('items') or []
+
+            for i in items:
+                listed[i['response_id']]=bool(i.get('submitted_at'))
+
+            if len(items) < self.respPageSize or responseSet.get('page_count',0) <= 1:
+                break
+
+            lastToken=items[-1]['token']
+
+        return listed
+
+
+
+    def iterResponsesByID(self,form,ids):
+        # Generator of raw pages of the responses of a form with these «ids»,
+        # self.reconcileBatch per request
+        for start in range(0,len(ids),self.reconcileBatch):
+            url=self.respIDsURL.format(
+                id=form,
+                psize=self.respPageSize,
+                ids=','.join(ids[start:start+self.reconcileBatch])
+            )
+
+            try:
+                responseSet=self.apiRequest(url,endpoint='responses',form=form)
+            except requests.exceptions.RequestException as error:
+                self.logger.error('Error trying to get responses of form «{}» by ID'.format(form), exc_info=True)
+                raise error
+
+            items=responseSet.get('items') or []
+
+            if len(items) > 0:
+                yield items
+
+
+
+    def makeID(self,content,contentEncoding='UTF-8',digester=base64.b85encode,algo=None,size=None):
+        if contentEncoding == 'UTF-8' and digester is base64.b85encode and algo is None and size is None:
+            return self.ids.make(content)
+
+        machine=hashlib.new(algo if algo else 'shake_256')
+        machine.update(content.encode(contentEncoding))
+        return digester(machine.digest(size if size else 20)).decode('ascii')
+
+
+
+    def makeIDs(self,contents,contentEncoding='UTF-8',digester=base64.b85encode,algo=None,size=None):
+        # Same as makeID() for a list of contents at once, not memoized
+        if contentEncoding == 'UTF-8' and digester is base64.b85encode and algo is None and size is None:
+            return self.ids.makeMany(contents)
+
+        return [self.makeID(c,contentEncoding,digester,algo,size) for c in contents]
+        
+    
+    def statistics(self):
+        self.logger.info('Number of forms: {}'.format(self.forms.shape[0]))
+        self.logger.info('Number of form fields: {}'.format(self.formItems.shape[0]))
+        self.logger.info('Number of unchanged forms skipped: {}'.format(self.counters['formsSkipped']))
+        self.logger.info('Number of pages resumed from checkpoint: {}'.format(self.counters['pagesResumed']))
+        self.logger.info('Number of responses: {}'.format(self.counters['responses']))
+        self.logger.info('Number of fields answered: {}'.format(self.counters['answers']))
+        self.logger.info('Number of API requests: {} ({} response count probes avoided)'.format(self.counters['apiRequests'],self.counters['probesAvoided']))
+        self.logger.info('Number of API retries: {} ({:.1f}s waiting)'.format(self.counters['apiRetries'],self.counters['retrySeconds']))
+        self.logger.info('Rate limit throttle wait: {:.1f}s'.format(self.counters['throttleSeconds']))
+        if self.sink:
+            self.logger.info('Parquet sink: {} files written, {} merged away by compaction, in {:.1f}s'.format(
+                self.counters['sinkFiles'],
+                self.counters['sinkFilesCompacted'],
+                self.counters['sinkSeconds']
+            ))
+        if self.counters['framesPlainBytes']:
+            self.logger.info('Transformed pages took {:.1f} MiB in memory, {:.1f} MiB as plain objects'.format(
+                self.counters['framesCompactBytes']/2**20,
+                self.counters['framesPlainBytes']/2**20
+            ))
+
+        self.logger.info('Time in API: {:.1f}s ({:.1f} MiB); transform: {:.1f}s; DB: {:.1f}s'.format(
+            self.counters['apiSeconds'],
+            self.counters['apiBytes']/2**20,
+            self.counters['transformSeconds'],
+            self.counters['dbSeconds']
+        ))
+
+        for stage,m in self.metrics.by('stage').items():
+            self.logger.info('Stage {}: {:.2f}s'.format(stage,m['stageSeconds']))
+
+        for table,m in self.metrics.by('table').items():
+            self.logger.info('Table «{}»: {} rows written in {:.2f}s ({:.0f} rows/s)'.format(
+                table,
+                m['rowsWritten'],
+                m['dbSeconds'],
+                m['rowsWritten']/m['dbSeconds'] if m['dbSeconds'] else 0
+            ))
+
+        self.logMetrics()
+
+        if self.metricsFile:
+            self.metrics.writePrometheus(self.metricsFile)
+
+
+
+    def logMetrics(self):
+        # All metrics as JSON log lines: one for the whole sync, then one per
+        # stage, API endpoint, form and table
+        snapshot=self.metrics.snapshot()
+
+        self.metricsLogger.info(json.dumps(
+            {'metrics': 'sync', 'version': __version__, 'seconds': snapshot['seconds'], **snapshot['totals']},
+            default=str
+        ))
+
+        for label in ['stage','endpoint','form','table']:
+            for value,m in snapshot[label].items():
+                line={'metrics': label, label: value, **m}
+
+                if label == 'endpoint' and value in snapshot['latency']:
+                    line['latency']=snapshot['latency'][value]
+
+                self.metricsLogger.info(json.dumps(line,default=str))
+
+        
+    
+    def getUpdates(self):
+        self.logger.debug('Requesting form updates…')
+
+        with self.metrics.timer('stageSeconds',stage='getForms'):
+            self.getForms()
+
+        with self.metrics.timer('stageSeconds',stage='getFormItems'):
+            self.getFormItems()
+
+        with self.metrics.timer('stageSeconds',stage='getResponses'):
+            self.getResponses()
+        
+        
+        
+    @contextlib.contextmanager
+    def transaction(self,name):
+        # One pooled connection and one transaction for a whole load, so
+        # everything in it becomes visible at once, or not at all
+        with self.db.connect() as con:
+            transaction=con.begin()
+
+            try:
+                yield con
+            except BaseException:
+                self.stagingUsed.pop(con,None)
+
+                start=time.monotonic()
+                transaction.rollback()
+                self.logger.error('Rolled back {} in {:.2f}s'.format(name,time.monotonic()-start))
+
+                with self.sinkLock:
+                    self.sinkPending.pop(con,None)
+
+                raise
+
+            self.stagingUsed.pop(con,None)
+
+            start=time.monotonic()
+            transaction.commit()
+            elapsed=time.monotonic()-start
+
+            self.count('dbCommitSeconds',elapsed)
+            self.logger.info('Committed {} in {:.2f}s'.format(name,elapsed))
+
+            self.flushSink(con)
+
+
+
+    def flushSink(self,con):
+        # Write to the sink what a transaction just committed to DB, so the
+        # sink never gets what was rolled back
+        with self.sinkLock:
+            pending=self.sinkPending.pop(con,[])
+
+        if self.sink is None or len(pending) == 0:
+            return
+
+        start=time.monotonic()
+        files=self.sink.write(pending)
+        elapsed=time.monotonic()-start
+
+        self.count('sinkSeconds',elapsed)
+        self.count('sinkFiles',files)
+
+        for df,table in pending:
+            if table == 'deleted':
+                self.count('sinkTombstones',df.shape[0])
+            else:
+                self.count('rowsSunk',df.shape[0],table=table)
+
+        self.logger.debug('Wrote {} Parquet files in {:.2f}s'.format(files,elapsed))
+
+
+
+    def compactSink(self):
+        start=time.monotonic()
+        removed=self.sink.compact()
+        elapsed=time.monotonic()-start
+
+        self.count('sinkSeconds',elapsed)
+        self.count('sinkFilesCompacted',removed)
+
+        self.logger.info('Compacted Parquet sink in {:.2f}s, {} files merged away'.format(elapsed,removed))
+
+
+
+    def serverPacketLimit(self):
+        # Chunks must fit in one packet on MySQL and MariaDB, with room left
+        # for SQL and escapes
+        if self.db.dialect.name == 'mysql':
+            with self.db.connect() as con:
+                packet=con.execute(sqlalchemy.text('SELECT @@max_allowed_packet')).scalar()
+
+            self.dbChunkMaxBytes=min(self.dbChunkMaxBytes,int(packet)*3//4)
+            self.logger.debug('Server packet limit is {} bytes, chunks up to {} bytes'.format(packet,self.dbChunkMaxBytes))
+
+
+
+    def chunkSizer(self,table,method):
+        with self.dbChunkSizersLock:
+            return self.dbChunkSizers.setdefault(
+                (table,method),
+                ChunkSizer(self.dbChunkBytes,self.dbChunkSeconds,self.dbChunkMaxBytes)
+            )
+
+
+
+    def writeChunks(self,df,table,method,write):
+        # Call write(chunk) for consecutive chunks of «df», adapting the size
+        # of the next chunk to how long the last one took
+        sizer=self.chunkSizer(table,method)
+
+        for chunk,size in sizer.chunks(df):
+            self.writeChunk(sizer,chunk,size,table,write)
+
+
+
+    def writeChunk(self,sizer,chunk,size,table,write):
+        start=time.monotonic()
+        write(chunk)
+        elapsed=time.monotonic()-start
+
+        sizer.record(size,elapsed)
+
+        self.logger.debug('Wrote {rows} rows ({size} bytes) of «{table}» in {elapsed:.3f}s; next chunk {next} bytes'.format(
+            rows=chunk.shape[0],
+            size=size,
+            table=table,
+            elapsed=elapsed,
+            next=sizer.bytes
+        ))
+
+
+
+    def concurrentDB(self):
+        # Whether DB can be written from other threads and connections while
+        # the sync transaction is open. Not SQLite: its connections can't move
+        # between threads and a single writer locks the whole database.
+        return self.db.dialect.name != 'sqlite'
+
+
+
+    def writeEntity(self,df,temp,table,con):
+        self.writeEntities([(df,temp,table)],con)
+
+
+
+    def writeEntities(self,entities,con):
+        # Upsert DataFrames into their target tables, given as a list of
+        # (df, temp, table) in foreign key order. Small deltas are written
+        # directly in batches. Large ones are first bulk loaded into their
+        # staging tables, all of them at once, and then merged in order, each
+        # in one statement.
+        entities=[(self.uniqueRows(df),temp,table) for df,temp,table in entities]
+        entities=[e for e in entities if e[0].shape[0] > 0]
+
+        for df,temp,table in entities:
+            self.logger.debug('Writting {rows} rows to «{table}» table in DB'.format(rows=df.shape[0],table=table))
+
+        if self.sink:
+            # Goes to the sink when this transaction commits
+            with self.sinkLock:
+                self.sinkPending.setdefault(con,[]).extend((df,table) for df,temp,table in entities)
+
+        staged=[e for e in entities if e[0].shape[0] >= self.dbStagingThreshold]
+        loadTimes=self.loadStaging(staged,con) if staged else {}
+
+        for df,temp,table in entities:
+            start=time.monotonic()
+
+            if table in loadTimes:
+                self.mergeStaging(df,temp,table,con)
+            else:
+                self.upsertDirect(df,table,con)
+
+            elapsed=time.monotonic() - start + loadTimes.get(table,0)
+
+            self.count('dbSeconds',elapsed,table=table)
+            self.count('rowsWritten',df.shape[0],table=table)
+            self.logger.debug('Wrote «{table}» in {elapsed:.2f}s'.format(table=table,elapsed=elapsed))
+
+
 
-    
-    # DB parameters
-    db=None
-    lastLanded=None
-    lastSubmitted=None
-    dbWriteChunckSize=3000 # records
-    tablePrefix=''
-    
-    # DataFrames for updated tables of entities to be synced
-    forms=None
-    formItems=None
-    responses=None
-    answers=None
-    
-    # Logging
-    response=None
-    logger=None
+    def uniqueRows(self,df):
+        # Same row twice in one statement is an error on ON CONFLICT dialects
+        return df[~df.index.duplicated(keep='last')].reset_index()
 
-    # Debug stuff
-    debugForms=['ARqhAx', 'KPbhd6'] #,'APiACy','YRyBYh']
-    
-    def __init__(self,token=None,dburl=None,restart=False,dbupdate=True,tableprefix=None):
-        self.token=token
-        self.dbURL=dburl
 
-        if tableprefix:
-            self.tablePrefix=tableprefix
-        
-        if __name__ == '__main__':
-            self.logger=logging.getLogger('TypeformETL.TypeformETL')
+
+    def upsertSQL(self,table,columns,select=None):
+        # Native upsert of «columns» into «table», keyed by 'id', in the dialect
+        # of our DB. Values come from bound parameters or from a «select».
+        # Only rows with some changed column are actually rewritten.
+        target=self.tablePrefix + table
+        update=[c for c in columns if c != 'id']
+
+        if select is None:
+            source='VALUES ({})'.format(','.join(':' + c for c in columns))
         else:
-            self.logger=logging.getLogger(__name__ + '.TypeformETL')
+            source=select
+
+        if self.db.dialect.name == 'mysql':
+            # MySQL and MariaDB don't write rows whose values didn't change
+            return 'INSERT INTO {target} ({columns}) {source} ON DUPLICATE KEY UPDATE {update}'.format(
+                target=target,
+                columns=','.join(columns),
+                source=source,
+                update=','.join('{c}=VALUES({c})'.format(c=c) for c in update)
+            )
+        else:
+            # PostgreSQL, SQLite and others with ON CONFLICT
+            return 'INSERT INTO {target} AS target ({columns}) {source} ON CONFLICT (id) DO UPDATE SET {update} WHERE ({old}) {distinct} ({new})'.format(
+                target=target,
+                columns=','.join(columns),
+                source=source,
+                update=','.join('{c}=excluded.{c}'.format(c=c) for c in update),
+                old=','.join('target.' + c for c in update),
+                new=','.join('excluded.' + c for c in update),
+                distinct='IS NOT' if self.db.dialect.name == 'sqlite' else 'IS DISTINCT FROM'
+            )
 
-        self.typeformHeader={'Authorization': f'Bearer {self.token}'}
-        
-        self.restart=restart
-        self.dbUpdate=dbupdate
-        
-        
 
-    def __connectDB(self):
+
+    def upsertDirect(self,df,table,con):
+        # Upsert rows straight into target table, in batches of bound parameters
+        sql=sqlalchemy.text(self.upsertSQL(table,list(df.columns)))
+
+        start=time.monotonic()
+
+        self.writeChunks(df,table,'direct',lambda chunk: con.execute(sql,self.asRecords(chunk)))
+
+        elapsed=time.monotonic()-start
+        self.logger.info('Upserted {rows} rows into «{table}» directly in {elapsed:.2f}s ({rate:.0f} rows/s)'.format(
+            rows=df.shape[0],
+            table=self.tablePrefix + table,
+            elapsed=elapsed,
+            rate=df.shape[0]/elapsed if elapsed else 0
+        ))
+
+
+
+    def asRecords(self,df):
+        # Rows of a DataFrame as dicts of plain Python values, NULLs as None,
+        # as all DB drivers understand them
+        records=df.astype(object)
+
+        for c in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[c]):
+                records[c]=pd.Series(df[c].dt.to_pydatetime(),index=df.index,dtype=object)
+
+        return records.where(df.notna(),None).to_dict('records')
+
+
+
+    def prepareStaging(self):
+        # Make sure staging tables with same columns as their targets exist.
+        # They are kept between syncs, so they are created only once, and
+        # here, outside of the load transaction, because DDL commits it on
+        # MySQL.
+        with self.db.begin() as con:
+            inspector=sqlalchemy.inspect(con)
+
+            for e in self.entities:
+                stage=self.tablePrefix + e['temp']
+                target=self.tablePrefix + e['table']
+
+                if inspector.has_table(stage):
+                    continue
+
+                if self.db.dialect.name == 'mysql':
+                    # Pandas plain to_sql() doesn't take care of correct column data type,
+                    # so we have to inherit from target table like this:
+                    con.execute(sqlalchemy.text(f'CREATE TABLE {stage} LIKE {target}'))
+                    con.execute(sqlalchemy.text(f'ALTER TABLE {stage} DROP PRIMARY KEY'))
+                elif self.db.dialect.name == 'postgresql':
+                    con.execute(sqlalchemy.text(f'CREATE UNLOGGED TABLE {stage} (LIKE {target} INCLUDING DEFAULTS)'))
+                else:
+                    con.execute(sqlalchemy.text(f'CREATE TABLE {stage} AS SELECT * FROM {target} WHERE 1=0'))
+
+
+
+    def emptyStaging(self,temp,con):
+        if self.db.dialect.name == 'postgresql':
+            con.execute(sqlalchemy.text(f'TRUNCATE TABLE {self.tablePrefix}{temp}'))
+        else:
+            # TRUNCATE is DDL on MySQL and would commit our transaction
+            con.execute(sqlalchemy.text(f'DELETE FROM {self.tablePrefix}{temp}'))
+
+
+
+    def loadStaging(self,entities,con):
+        # Bulk load DataFrames of «entities», a list of (df, temp, table), into
+        # their staging tables and return seconds taken by each table.
+        # With one DB connection everything goes through «con», inside the
+        # sync transaction. With more, chunks of all tables are loaded at the
+        # same time, each on its own pooled connection and transaction;
+        # staging tables are only an intermediate step, so the sync is still
+        # atomic where it matters: merges into target tables happen in «con»,
+        # and their INSERT … SELECT sees staging rows committed by the loaders.
+        # A staging table already merged or emptied in «con» is locked by it
+        # until commit, and other connections would wait on it forever: then
+        # everything goes through «con».
+        loader=self.bulkLoader()
+        used=self.stagingUsed.setdefault(con,set())
+        parallel=(
+            self.dbConnections > 1 and self.concurrentDB() and
+            not any(temp in used for df,temp,table in entities)
+        )
+        elapsed={}
+
         try:
-            self.db=sqlalchemy.create_engine(self.dbURL, encoding='utf8')
-        except sqlalchemy.exc.SQLAlchemyError as error:
-            self.logger.error('Can’t connect to DB.', exc_info=True)
+            if parallel:
+                with self.db.begin() as c:
+                    for df,temp,table in entities:
+                        self.emptyStaging(temp,c)
+
+                def load(sizer,chunk,size,temp,table):
+                    with self.db.begin() as c:
+                        self.writeChunk(sizer,chunk,size,table,lambda chunk: loader(chunk,self.tablePrefix + temp,c))
+
+                with ThreadPoolExecutor(max_workers=self.dbConnections) as executor:
+                    jobs=[]
+                    for df,temp,table in entities:
+                        # Chunks are cut as fast as they are submitted, with
+                        # the size learned so far
+                        sizer=self.chunkSizer(table,'bulk')
+                        start=time.monotonic()
+                        jobs.append((table,start,[executor.submit(load,sizer,chunk,size,temp,table) for chunk,size in sizer.chunks(df)]))
+
+                    for table,start,futures in jobs:
+                        for future in futures:
+                            future.result()
+
+                        elapsed[table]=time.monotonic()-start
+            else:
+                for df,temp,table in entities:
+                    start=time.monotonic()
+                    used.add(temp)
+                    self.emptyStaging(temp,con)
+
+                    self.writeChunks(df,table,'bulk',lambda chunk: loader(chunk,self.tablePrefix + temp,con))
+
+                    elapsed[table]=time.monotonic()-start
+        except BaseException as error:
+            self.logger.error('Error writting temporary table to database.', exc_info=True)
             raise error
 
-            
-            
-            
-            
-    def __getLastSync(self):
-        if self.restart:
-            self.lastLanded = None
-            self.lastSubmitted = None
-        else:
-            lasts=pd.read_sql(f"select max(landed) as landed, max(submitted) as submitted from {self.tablePrefix}responses;", self.db)
-            self.lastLanded = lasts['landed'].values[0]
-            self.lastSubmitted = lasts['submitted'].values[0]
+        for df,temp,table in entities:
+            self.logger.info('Loaded {rows} rows into «{table}» with {loader} on {connections} connections in {elapsed:.2f}s ({rate:.0f} rows/s)'.format(
+                rows=df.shape[0],
+                table=self.tablePrefix + temp,
+                loader=loader.__name__,
+                connections=self.dbConnections if parallel else 1,
+                elapsed=elapsed[table],
+                rate=df.shape[0]/elapsed[table] if elapsed[table] else 0
+            ))
 
-        if self.lastLanded != None:
-            self.lastLanded = datetime.utcfromtimestamp(self.lastLanded.astype(int) * 1e-9)
-        else:
-            self.lastLanded = datetime(1970,1,1)
+        return elapsed
 
-        if self.lastSubmitted != None:
-            self.lastSubmitted = datetime.utcfromtimestamp(self.lastSubmitted.astype(int) * 1e-9)
-        else:
-            self.lastSubmitted = datetime(1970,1,1)
 
 
+    def mergeStaging(self,df,temp,table,con):
+        # Upsert all rows of a loaded staging table into its target table with
+        # one INSERT … SELECT, and empty it
+        columns=list(df.columns)
 
+        self.stagingUsed.setdefault(con,set()).add(temp)
 
-        
-    def __setLastSync(self):
-        lastData=self.responses['landed'].sort_values(ascending=False).head(1)[0]
+        con.execute(sqlalchemy.text(self.upsertSQL(
+            table,
+            columns,
+            # WHERE is needed by SQLite to parse ON CONFLICT after a SELECT
+            select='SELECT {columns} FROM {stage} WHERE 1=1'.format(columns=','.join(columns),stage=self.tablePrefix + temp)
+        )))
 
-        # Set last sync date
-        self.db.execute("UPDATE {pref}options SET value='{last}' WHERE name='typeform_last'".format(last=lastData,pref=self.tablePrefix))
+        self.emptyStaging(temp,con)
 
-        # Update the sync log
-        self.db.execute("INSERT INTO {}synclog (timestamp,version,forms,form_items,responses,answers) VALUES (UTC_TIMESTAMP(),'{}',{},{},{},{})".format(
-            self.tablePrefix,
-            __version__,
-            self.forms.shape[0],
-            self.formItems.shape[0],
-            self.responses.shape[0],
-            self.answers.shape[0]
-        ))
-        
-#        # Update the daily NPS materialized view
-#        if self.answers.shape[0] > 0:
-#            # This is a heavy task, so only if we have new answers
-#            
-#            self.logger.debug('Update nps_daily_mv materialized view…')
-#
-##             DROP TABLE IF EXISTS tf_nps_daily_mv2;
-##             CREATE TABLE tf_nps_daily_mv2 AS SELECT * FROM tf_nps_daily;
-##             DROP TABLE IF EXISTS tf_nps_daily_mv;
-##             RENAME TABLE tf_nps_daily_mv2 TO tf_nps_daily_mv;
-#            
-#            self.db.execute(f"DROP TABLE IF EXISTS {self.tablePrefix}nps_daily_mv2;")
-#            self.db.execute(f"CREATE TABLE {self.tablePrefix}nps_daily_mv2 AS SELECT * FROM {self.tablePrefix}nps_daily;")
-#                            
-#            self.db.execute(f"DROP TABLE IF EXISTS {self.tablePrefix}nps_daily_mv;")
-#            self.db.execute(f"RENAME TABLE {self.tablePrefix}nps_daily_mv2 TO {self.tablePrefix}nps_daily_mv;")
 
-        
-                
-    def getWorkspaces(self):
-        # Still unimplemented
-        workspaceColumns=['id', 'url', 'title']
 
+    def bulkLoader(self):
+        # The bulk load method for the dialect of our database, from
+        # self.bulkLoaders, or multi-row INSERTs for any other database
+        return getattr(self,self.bulkLoaders.get(self.db.dialect.name,'loadInsert'))
 
-    
-    def getForms(self):
-        forms=[]
 
-        # This column order (and names) must match the respective table in the database
-        formColumns=['id', 'workspace', 'updated', 'url', 'title','description']
-        
-        self.logger.debug('Requesting forms…')
 
+    def asTSV(self,df):
+        # Text of a DataFrame as one TSV line per row, with backslash escapes
+        # and \N for NULL, as understood by both MySQL LOAD DATA and
+        # PostgreSQL COPY text format
+        lines=None
+        for c in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[c]):
+                text=df[c].dt.strftime('%Y-%m-%d %H:%M:%S')
+            else:
+                text=df[c].astype(str)
+
+            text=(text
+                .str.replace('\\','\\\\',regex=False)
+                .str.replace('\t','\\t',regex=False)
+                .str.replace('\n','\\n',regex=False)
+                .str.replace('\r','\\r',regex=False)
+            )
+            text[df[c].isna()]='\\N'
+
+            lines=text if lines is None else lines + '\t' + text
+
+        if lines is None or lines.shape[0] == 0:
+            return ''
+
+        return '\n'.join(lines) + '\n'
+
+
+
+    def loadDataInfile(self,df,table,con):
+        # MySQL and MariaDB: LOAD DATA LOCAL INFILE from a temporary TSV file.
+        # Server must have local_infile enabled.
+        with tempfile.NamedTemporaryFile('w',encoding='utf-8',suffix='.tsv') as tsv:
+            tsv.write(self.asTSV(df))
+            tsv.flush()
+
+            con.execute(sqlalchemy.text(
+                "LOAD DATA LOCAL INFILE '{file}' INTO TABLE {table} CHARACTER SET utf8mb4 ({columns})".format(
+                    file=tsv.name,
+                    table=table,
+                    columns=','.join(df.columns)
+                )
+            ))
+
+
+
+    def loadCopy(self,df,table,con):
+        # PostgreSQL: COPY FROM STDIN in text format, through psycopg2 or psycopg 3
+        sql='COPY {table} ({columns}) FROM STDIN'.format(table=table,columns=','.join(df.columns))
+        data=self.asTSV(df)
+
+        cursor=con.connection.cursor()
         try:
-            self.response=requests.get(self.formListURL.format(page=1),
-                                  headers=self.typeformHeader).json()
-        except:
-            self.logger.error('Error trying to get forms.', exc_info=True)
-            raise
+            if hasattr(cursor,'copy_expert'):
+                cursor.copy_expert(sql,io.StringIO(data))
+            else:
+                with cursor.copy(sql) as copy:
+                    copy.write(data)
+        finally:
+            cursor.close()
 
-        for f in self.response['items']:
-#             if f['id'] not in self.debugForms:
-#                 continue
 
-            form={}
-            form['id']        =f['id']
-            #form['workspace'] =f['workspace']['href'][:-6]
-            form['url']       =f['_links']['display']
-            form['title']     =f['title']
-#             form['ref']       =f['ref']
-            form['updated']   =dateparser.parse(f['last_updated_at']).replace(tzinfo=None)
 
-            forms.append(form)
+    def loadInsert(self,df,table,con):
+        # Any database: multi-row INSERTs, as many rows per statement as the
+        # bound parameters limit allows
+        df.to_sql(
+            name=table,
+            index=False,
+            if_exists='append',
+            method='multi',
+            chunksize=max(1,self.dbMaxParameters//max(1,df.shape[1])),
+            con=con
+        )
 
-        self.forms=pd.DataFrame(columns=formColumns)
-        self.forms=self.forms.append(forms)
-        self.forms.set_index('id',inplace=True)
 
-        del forms
 
-        
-        
-    def getFormItems(self):
-        field  = {}
-        fields = []
+    def syncUpdates(self,con,entities=None):
+        # Write all entities (or only the ones named in «entities») to DB
+        self.logger.debug('Writting updates to DB…')
 
-        # This column order (and names) must match the respective table in the database
-        formItemsColumns=['id','parent_id','form','position','name','parent_name','type','title','description']
+        self.writeEntities(
+            [
+                (self.__dict__[e['df']],e['temp'],e['table'])
+                for e in self.entities
+                if entities is None or e['df'] in entities
+            ],
+            con
+        )
+
+
+
+    def reconcile(self,con):
+        # Compare responses of the last self.reconcileDays on Typeform and in
+        # DB, form by form, and apply only the differences: responses missing
+        # in DB or submitted after we got them as partial are fetched again
+        # by ID, and responses deleted on Typeform are deleted from DB.
+        # Catches what incremental syncs can't see, without a full --restart.
+        since=(datetime.utcnow() - timedelta(days=self.reconcileDays)).replace(microsecond=0)
+
+        self.logger.debug('Reconciling responses since {}…'.format(since))
+
+        # Only responses that landed in the window can be missing on
+        # Typeform's listing; the ones just submitted in it are compared too
+        stored=pd.read_sql(
+            sqlalchemy.text(f"select id, form, submitted, case when landed > :since then 1 else 0 end as recent from {self.tablePrefix}responses where landed > :since or submitted > :since"),
+            con,
+            params={'since': since}
+        )
+        stored={form: rows.set_index('id') for form,rows in stored.groupby('form')}
+
+        # Answers of the listing are reduced to the first question of each form
+        firstFields=pd.read_sql(
+            sqlalchemy.text(f"select form, id from {self.tablePrefix}form_items where type <> 'hidden' and parent_id is null order by form, position"),
+            con
+        ).groupby('form')['id'].first()
+
+        def reconcileForm(form):
+            listed=self.listResponseIDs(form,since,firstFields.get(form))
+            mine=stored.get(form,pd.DataFrame(columns=['submitted','recent']))
+
+            deleted=sorted(mine.index[mine['recent'].astype(bool)].difference(list(listed.keys())))
+            missing=sorted(i for i in listed if i not in mine.index)
+            completed=sorted(i for i,submitted in listed.items() if submitted and i in mine.index and pd.isna(mine.at[i,'submitted']))
+
+            frames=[]
+            for items in self.iterResponsesByID(form,missing + completed):
+                frames.append(self.transformResponses(form,items))
+
+            self.count('reconcileDeleted',len(deleted),form=form)
+            self.count('reconcileMissing',len(missing),form=form)
+            self.count('reconcileCompleted',len(completed),form=form)
+
+            return (deleted,frames)
+
+        deleted=[]
+        frames=[]
+        for formDeleted,formFrames in self.forEachForm(reconcileForm):
+            deleted.extend(formDeleted)
+            frames.extend(formFrames)
+
+        if len(deleted) > 0:
+            self.deleteResponses(deleted,con)
+
+        if len(frames) > 0:
+            responses=self.concatFrames([f[0] for f in frames])
+
+            self.writeEntities(
+                [
+                    (responses,'responses_temp','responses'),
+                    (self.concatFrames([f[1] for f in frames]).sort_values(by='response'),'answers_temp','answers')
+                ],
+                con
+            )
+
+            self.touchDays(responses)
+
+        self.reconciledAt=time.time()
+
+        self.logger.info('Reconciled responses since {}: {} missing, {} completed, {} deleted'.format(
+            since,
+            self.counters['reconcileMissing'],
+            self.counters['reconcileCompleted'],
+            self.counters['reconcileDeleted']
+        ))
 
-        self.logger.debug('Requesting form items…')
 
-#         for form in self.debugForms:
-        for form in self.forms.index.sort_values():
-            self.response=None
-            field_index=0
-            try:
-                self.response=requests.get(self.formItemsURL.format(id=form),
-                       headers=self.typeformHeader).json()
-                self.logger.debug('Requested: ' + self.formItemsURL.format(id=form))
-            except requests.exceptions.RequestException as error:
-                self.logger.error('Error trying to get form items', exc_info=True)
-                raise error
 
-            # Get form's workspace ID from last 6 chars on workspace URL
-            self.forms.at[form,'workspace'] = self.response['workspace']['href'][-6:]
-
-            if 'hidden' in self.response:
-                for f in self.response['hidden']:
-                    field = {}
-                    field['form']      = form
-                    field['title']     = f
-                    field['name']      = f
-                    field['type']      = 'hidden'
-                    field['position']  = field_index
-
-                    field['id']        = self.makeID('{}hidden{}'.format(form,f))
-
-                    fields.append(field)
-                    field_index += 1
-                    del field
-
-            if 'fields' in self.response:
-                for f in self.response['fields']:                
-                    field = {}
-                    field['form']               = form
-                    field['id']                 = f['id']
-                    field['title']              = f['title']
-                    field['name']               = f['ref']
-                    field['type']               = f['type']
-                    field['position']           = field_index
-                    
-                    if 'properties' in f and 'description' in f['properties']:
-                        field['description']    = f['properties']['description']
+    def reconciling(self):
+        # Reconciliation compares with Typeform itself, so not when replaying
+        # from cache
+        if self.reconcileDays is None or self.replay:
+            return False
 
-                    fields.append(field)
-                    field_index += 1
-                    del field
-                
-                    # Handle sub fields (under group fields)
-                    if 'properties' in f and 'fields' in f['properties']:
-                        for subf in f['properties']['fields']:
-                            field = {}
-                            field['form']               = form
-                            field['parent_id']          = f['id']
-                            field['id']                 = subf['id']
-                            field['title']              = subf['title']
-                            field['name']               = subf['ref']
-                            field['parent_name']        = f['ref']
-                            field['type']               = subf['type']
-                            field['position']           = field_index
-
-                            if 'properties' in subf and 'description' in subf['properties']:
-                                field['description']    = subf['properties']['description']
-
-                            fields.append(field)
-                            field_index += 1
-                            del field
-        
-        self.formItems=pd.DataFrame(columns=formItemsColumns)
-        self.formItems=self.formItems.append(fields)
-        self.formItems.set_index('id',inplace=True)
+        # Daemon syncs often; reconcile only every self.reconcileInterval
+        if self.scheduler and self.lastReconciled and time.time()-self.lastReconciled < self.reconcileInterval:
+            return False
 
-        del fields
-        
+        return True
 
-        
-    def getResponses(self):
-        meta     = {}
-        metas    = []
-        answer   = {}
-        answers  = []
 
-        # This column order (and names) must match the respective table in the database
-        metaColumns=['id', 'form', 'ip_address', 'landed', 'submitted', 'agent', 'referer']
-        answerColumns=['id', 'form', 'response', 'sequence', 'field', 'data_type_hint', 'answer']
-        
 
-#         for form in self.debugForms:
-        for form in self.forms.index.sort_values():
-            for completed in [True,False]:
-            
-                if completed:
-                    since=self.lastSubmitted.isoformat()
-                else:
-                    since=self.lastLanded.isoformat()
-            
-                self.response=None
-                try:
-                    self.logger.debug('Requesting response statistics for form «{}», submitted={}…'.format(form,completed))
+    def deleteResponses(self,ids,con):
+        # Delete responses and their answers by response ID; answers first,
+        # for tables without ON DELETE CASCADE
+        # Days they counted in are aggregated again, and the sink gets
+        # tombstones for them when this transaction commits
+        days=sqlalchemy.text(f'SELECT id, form, landed, submitted FROM {self.tablePrefix}responses WHERE id IN :ids').bindparams(
+            sqlalchemy.bindparam('ids',expanding=True)
+        )
 
-                    self.response=requests.get(
-                            self.respListURL.format(id=form, psize=1, page=1,
-                                       completed=str(completed).lower(),
-                                       since=since
-                            ),
-                            headers=self.typeformHeader
-                    ).json()
+        # Bounded number of parameters per statement
+        for start in range(0,len(ids),500):
+            deleted=pd.read_sql(days,con,params={'ids': ids[start:start+500]})
+            self.touchDays(deleted)
 
+            if self.sink:
+                with self.sinkLock:
+                    self.sinkPending.setdefault(con,[]).append((deleted[['id','form','landed']],'deleted'))
 
-                    #self.logger.debug('Form «{}», submitted={}, looks like: {}'.format(form,completed,str(self.response)[:150]))
+        for table,column in [('answers','response'),('responses','id')]:
+            sql=sqlalchemy.text(f'DELETE FROM {self.tablePrefix}{table} WHERE {column} IN :ids').bindparams(
+                sqlalchemy.bindparam('ids',expanding=True)
+            )
 
-                except requests.exceptions.RequestException as error:
-                    self.logger.error('Error trying to get response statistics for form «{}».'.format(form), exc_info=True)
-                    raise error
+            for start in range(0,len(ids),500):
+                con.execute(sql,{'ids': ids[start:start+500]})
 
-                if 'total_items' in self.response.keys():
-                    number_of_pages_of_1000_responses = math.ceil(self.response['total_items']/1000)
-                else:
-                    number_of_pages_of_1000_responses = 0
-
-                lastToken=None
-                for page in range(1,number_of_pages_of_1000_responses+1):
-                    try:                    
-                        url=self.respListURL.format(
-                            id=form, psize=1000,
-                            page=page, completed=str(completed).lower(),
-                            since=since
-                        )
-
-                        if lastToken:
-                            # Append last token we have for this page
-                            url += f'&before={lastToken}'
-
-                        
-                        responseSet=requests.get(url,headers=self.typeformHeader).json()
-                        
-#                         self.logger.debug(responseSet)
-
-                        self.logger.debug('Requesting responses for form «{}»: {} answers'.format(form,responseSet['total_items']))
-                        self.logger.debug(f'Requesting from: {url}')
-
-                    except requests.exceptions.RequestException as error:
-                        self.logger.error('Error trying to get response details for form «{}»'.format(form), exc_info=True)
-                        raise error
-
-
-
-                    for i in responseSet['items']:
-    #                         self.logger.debug(f"working on: {i}")
-
-                        meta = {}
-                        meta['id']          = i['response_id']
-                        meta['form']        = form
-                        meta['landed']      = dateparser.parse(i['landed_at']).replace(tzinfo=None)
-                        meta['agent']       = i['metadata']['user_agent']
-                        meta['referer']     = i['metadata']['referer']
-
-                        if 'network_id' in i['metadata']:
-                            meta['ip_address'] = i['metadata']['network_id']
-
-                        if 'submitted_at' in i:
-                            # apparently became an optional parameter in 2020-03-02
-                            meta['submitted'] = dateparser.parse(i['submitted_at']).replace(tzinfo=None)
-
-                        lastToken=i['token'] # generally same as i['response_id'], but just to follow docs
-                        metas.append(meta)
-
-                        seq=0
-
-                        # Handle all hidden fields of response
-                        for t in ['hidden']: #,'calculated']:
-                            if t in i.keys():
-                                for field in i[t].keys():
-                                    answer = {}
-                                    answer['id']          =  self.makeID('{}{}{}'.format(form,meta['id'],field))
-                                    answer['response']    =  meta['id']
-                                    answer['form']        =  form
-                                    answer['sequence']    =  seq
-                                    answer['answer']      =  i[t][field]
-                                    answer['field']       =  self.makeID('{}{}{}'.format(form,t,field))
-
-                                    answer['data_type_hint'] = t
-
-                                    answers.append(answer)
-                                    seq+=1
-
-
-                        # Handle all regular fields of response
-                        if 'answers' in i.keys():
-                            # apparently content into 'ansewrs' became optional in 2020-03-02
-                            if i['answers'] is None:
-                                # Flag submitted as Null if there are no answers
-                                meta['submitted'] = None
-                            else:
-                                for field in i['answers']:
-                                    answer = {}
-                                    answer['id']       =  self.makeID('{}{}{}'.format(form,meta['id'],field['field']['id']))
-                                    answer['response'] =  meta['id']
-                                    answer['form']     =  form
-                                    answer['sequence'] =  seq
-                                    answer['field']    =  field['field']['id']
-                                    answer['data_type_hint'] = field['type']
-
-
-                                    # Handle multichoice fields
-                                    if field['type'] == 'choices' or field['type'] == 'choice':
-                                        answer['answer'] = {}
-                                        
-                                        if 'labels' in field[field['type']] or 'label' in field[field['type']]:
-                                            if field['type'] == 'choices':
-                                                # Multi-choice
-                                                answer['answer'] = dict(zip(
-                                                    field[field['type']]['ids'],
-                                                    field[field['type']]['labels']
-                                                ))
-                                            else:
-                                                # Single choice
-                                                answer['answer'][field[field['type']]['id']] = str(field[field['type']]['label'])
-                                                
-                                        if 'other' in field[field['type']]:
-                                            answer['answer']['other'] = field[field['type']]['other']
-
-                                        # convert to compressed Unicode JSON to store in DB
-                                        answer['answer']=json.dumps(
-                                            answer['answer'],
-                                            ensure_ascii=False,
-                                            separators=(',', ':')
-                                        )
-                                    else:
-                                        # Default: just get the content, always as a string
-                                        answer['answer'] = str(field[field['type']])
-
-                                    answers.append(answer)
-                                    seq+=1
-
-
-        self.responses=pd.DataFrame(columns=metaColumns)
-        if len(metas)>0:
-            self.responses=self.responses.append(metas)
-        
-        # Sort reponses by «landed» time
-        self.responses.sort_values(by='landed', inplace=True)
-        self.responses.set_index('id',inplace=True)
-#         self.logger.debug(self.responses)
-        del metas
 
-        self.answers=pd.DataFrame(columns=answerColumns)
-        if len(answers)>0:
-            self.answers=self.answers.append(answers)
-        self.answers.set_index('id',inplace=True)
-        
-        # Sort answers by reponses’ «landed» time
-#         self.answers['response']=pd.Categorical(self.answers['response'],self.responses.sort_values(by='landed').index)
-        self.answers.sort_values(by='response', inplace=True)
-        del answers    
-    
 
-    def makeID(self,content,contentEncoding='UTF-8',digester=base64.b85encode,algo='shake_256',size=20):
-        machine=hashlib.new(algo)
-        machine.update(content.encode(contentEncoding))
-        return digester(machine.digest(size)).decode('ascii')
-        
-    
-    def statistics(self):
-        self.logger.info('Number of forms: {}'.format(self.forms.shape[0]))
-        self.logger.info('Number of form fields: {}'.format(self.formItems.shape[0]))
-        self.logger.info('Number of responses: {}'.format(self.responses.shape[0]))
-        self.logger.info('Number of fields answered: {}'.format(self.answers.shape[0]))
+    def touchDays(self,responses):
+        # Record the (form, day) buckets of submitted «responses», to be
+        # aggregated again at the end of the sync
+        submitted=responses['submitted'].notna()
+
+        self.touchedDays.update(zip(
+            responses['form'][submitted].astype(str),
+            pd.to_datetime(responses['submitted'][submitted]).dt.date
+        ))
 
-        
-    
-    def getUpdates(self):
-        self.logger.debug('Requesting form updates since {}…'.format(self.lastSubmitted))
+
+
+    def updateNPSDaily(self,con):
+        # Recompute only the (form, day) buckets of nps_daily_counts touched
+        # by this sync, from their answers in DB, so its cost follows the size
+        # of the delta and not of the whole history. Each touched bucket is
+        # replaced: deleted, then inserted again with one INSERT … SELECT per
+        # form, which also drops buckets left with no answers.
+        # An empty table, as just created on an existing database, is filled
+        # with all days at once instead.
+        table=self.tablePrefix + 'nps_daily_counts'
+
+        if not self.npsDaily:
+            return
+
+        inspector=sqlalchemy.inspect(con)
+        if not inspector.has_table(table):
+            self.logger.debug('No «{}» table, skipping NPS aggregates'.format(table))
+            return
+
+        if not {'form','field','day'} <= {c['name'] for c in inspector.get_columns(table)}:
+            self.logger.warning('«{}» is not a table of NPS aggregates, skipping them'.format(table))
+            return
+
+        start=time.monotonic()
+
+        if con.execute(sqlalchemy.text(f'SELECT count(*) FROM {table}')).scalar() == 0:
+            rows=con.execute(sqlalchemy.text(self.npsDailySQL())).rowcount
+
+            elapsed=time.monotonic()-start
+            self.count('dbSeconds',elapsed,table='nps_daily_counts')
+            self.count('rowsWritten',rows,table='nps_daily_counts')
+
+            self.logger.info('Filled «{table}» with {rows} rows of all days in {elapsed:.2f}s'.format(
+                table=table,
+                rows=rows,
+                elapsed=elapsed
+            ))
+
+            self.touchedDays=set()
+            return
+
+        if len(self.touchedDays) == 0:
+            return
+
+        days=collections.defaultdict(list)
+        for form,day in self.touchedDays:
+            days[form].append(day)
+
+        delete=sqlalchemy.text(f'DELETE FROM {table} WHERE form=:form AND day IN :days').bindparams(
+            sqlalchemy.bindparam('days',expanding=True)
+        )
+
+        # Range on submitted lets the index narrow the scan before date()
+        insert=sqlalchemy.text(self.npsDailySQL("""
+                AND a.form = :form
+                AND r.submitted >= :first
+                AND r.submitted < :last
+                AND date(r.submitted) IN :days
+        """)).bindparams(sqlalchemy.bindparam('days',expanding=True))
+
+        rows=0
+
+        for form in sorted(days):
+            formDays=sorted(days[form])
+
+            for chunk in range(0,len(formDays),500):
+                chunkDays=formDays[chunk:chunk+500]
+
+                con.execute(delete,{'form': form, 'days': chunkDays})
+                rows += con.execute(insert,{
+                    'form':  form,
+                    'days':  chunkDays,
+                    'first': datetime.combine(chunkDays[0],datetime.min.time()),
+                    'last':  datetime.combine(chunkDays[-1] + timedelta(days=1),datetime.min.time())
+                }).rowcount
+
+        elapsed=time.monotonic()-start
+        self.count('dbSeconds',elapsed,table='nps_daily_counts')
+        self.count('rowsWritten',rows,table='nps_daily_counts')
+        self.count('npsDaysUpdated',len(self.touchedDays))
+
+        self.logger.info('Updated {days} days of {forms} forms in «{table}» in {elapsed:.2f}s'.format(
+            days=len(self.touchedDays),
+            forms=len(days),
+            table=table,
+            elapsed=elapsed
+        ))
+
+        self.touchedDays=set()
+
+
+
+    def npsDailySQL(self,where=''):
+        # INSERT … SELECT of nps_daily_counts buckets of all days, or only of
+        # the ones selected by «where». Answers are text: cast them to compare
+        # as numbers on all databases.
+        return f"""
+            INSERT INTO {self.tablePrefix}nps_daily_counts (form, field, day, detractors, passives, promoters, total, answer_sum)
+            SELECT
+                a.form,
+                a.field,
+                date(r.submitted),
+                count(case when CAST(a.answer AS DECIMAL(10,2)) < 7 then 1 else NULL end),
+                count(case when CAST(a.answer AS DECIMAL(10,2)) between 7 and 8 then 1 else NULL end),
+                count(case when CAST(a.answer AS DECIMAL(10,2)) >= 9 then 1 else NULL end),
+                count(a.answer),
+                sum(CAST(a.answer AS DECIMAL(10,2)))
+            FROM {self.tablePrefix}answers a
+            JOIN {self.tablePrefix}responses r ON r.id = a.response
+            WHERE
+                a.data_type_hint = 'number'
+                AND r.submitted IS NOT NULL
+                {where}
+            GROUP BY a.form, a.field, date(r.submitted)
+        """
+
+
+
+    def syncStreaming(self):
+        # Extract, transform and load page by page: each page of responses is
+        # written to the DB while the next ones are being fetched, so the
+        # whole account is never held in memory.
+        # Each page goes in its own transaction, so responses never get to
+        # DB without their answers.
+        self.logger.debug('Streaming updates to DB…')
 
         self.getForms()
         self.getFormItems()
-        self.getResponses()
-        
-        
-        
-    def syncUpdates(self):
-        self.logger.debug('Writting updates to DB…')
 
-        comb = [
-            {'df': 'forms',     'temp': 'forms_temp',      'table': 'forms'},
-            {'df': 'formItems', 'temp': 'form_items_temp', 'table': 'form_items'},
-            {'df': 'responses', 'temp': 'responses_temp',  'table': 'responses'},
-            {'df': 'answers',   'temp': 'answers_temp',    'table': 'answers'}
-        ]
-        
-        for e in comb:
-            self.logger.debug('Writting «{df}» dataframe updates to «{table}» table in DB'.format(df=e['df'],table=e['table']))
+        def writeForms():
+            with self.transaction('forms') as con:
+                self.syncUpdates(con,['forms','formItems'])
 
-            try:
-                
-                # Pandas plain to_sql() doesn't take care of correct column data type,
-                # so we have to inherit from target table like this:
-                self.db.execute('DROP TABLE IF EXISTS {prefix}{temp};'.format(temp=e['temp'],target=e['table'],prefix=self.tablePrefix))
-                self.db.execute('CREATE TABLE {prefix}{temp} LIKE {prefix}{target};'.format(temp=e['temp'],target=e['table'],prefix=self.tablePrefix))
-                self.db.execute('ALTER TABLE {prefix}{temp} DROP PRIMARY KEY;'.format(temp=e['temp'],target=e['table'],prefix=self.tablePrefix))
-
-                if self.__dict__[e['df']].shape[0] > 1.25*self.dbWriteChunckSize:
-                    chunkIndex=0
-                    for chunk in range(0,math.ceil(self.__dict__[e['df']].shape[0]/self.dbWriteChunckSize)):
-                        self.logger.debug('Writting «{df}» to DB: [{start}:{end})'.format(
-                            df=e['df'],
-                            start=chunk*self.dbWriteChunckSize,
-                            end=(chunk+1)*self.dbWriteChunckSize
-                        ))
-#                         self.__dict__[e['df']][chunk*self.dbWriteChunckSize:(chunk+1)*self.dbWriteChunckSize].reset_index().to_csv(
-#                             f"{e['temp']}.{chunkIndex}.tsv",
-#                             sep='\t',
-#                             index=False
-#                         )
-                        
-                        self.__dict__[e['df']][chunk*self.dbWriteChunckSize:(chunk+1)*self.dbWriteChunckSize].reset_index().to_sql(
-                            name=self.tablePrefix + e['temp'],
-                            index=False,
-    #                         dtype=blobs,
-    #                         method=None,
-                            if_exists='append',
-                            con=self.db
-                        )
-                        chunkIndex+=1
-                        
-                        
-                else:
-#                     self.__dict__[e['df']].reset_index().to_csv(
-#                         f"{e['temp']}.tsv",
-#                         sep='\t',
-#                         index=False
-#                     )
-                    self.__dict__[e['df']].reset_index().to_sql(
-                        name=self.tablePrefix + e['temp'],
-                        index=False,
-    #                     dtype=blobs,
-    #                     method=None,
-                        if_exists='replace',
-                        con=self.db
+        # Forms and their items are written while first pages are fetched,
+        # but must be in DB before any response
+        forms=None
+        if self.dbUpdate:
+            if self.concurrentDB():
+                loader=ThreadPoolExecutor(max_workers=1)
+                forms=loader.submit(writeForms)
+                loader.shutdown(wait=False)
+            else:
+                writeForms()
+
+        self.responses=pd.DataFrame(columns=self.responseColumns).set_index('id')
+        self.answers=pd.DataFrame(columns=self.answerColumns).set_index('id')
+
+        for form,completed,token,responses,answers in self.streamResponses():
+            if responses.shape[0] == 0:
+                continue
+
+            if self.dbUpdate:
+                if forms:
+                    forms.result()
+
+                with self.transaction('page of form «{}»'.format(form)) as con:
+                    self.writeEntities(
+                        [
+                            (responses,'responses_temp','responses'),
+                            (answers.sort_values(by='response'),'answers_temp','answers')
+                        ],
+                        con
                     )
-            except BaseException as e:
-                self.logger.error('Error writting temporary table to database.', exc_info=True)
-                raise e
 
+                self.touchDays(responses)
+
+                if self.checkpoint:
+                    self.checkpoint.page(form,completed,token,self.since(form,completed))
+
+            self.count('responses',responses.shape[0])
+            self.count('answers',answers.shape[0])
 
+            pageNewest=responses['landed'].max()
+            if self.newestLanded is None or pageNewest > self.newestLanded:
+                self.newestLanded=pageNewest
 
-            self.db.execute('INSERT INTO {prefix}{target} (SELECT * FROM {prefix}{temp}) ON DUPLICATE KEY UPDATE id=VALUES(id); DROP TABLE {prefix}{temp}'.format(temp=e['temp'],target=e['table'],prefix=self.tablePrefix))
+        if forms:
+            # Also when there was no response at all
+            forms.result()
         
 
+
     def sync(self):
-        self.__connectDB()
+        if self.db is None:
+            self.__connectDB()
         self.__getLastSync()
 
-        self.getUpdates()
-        
         if self.dbUpdate:
-            self.syncUpdates()
-            self.__setLastSync()
+            self.prepareStaging()
+            self.serverPacketLimit()
+
+        if self.streaming:
+            with self.metrics.timer('stageSeconds',stage='syncStreaming'):
+                self.syncStreaming()
+
+            if self.dbUpdate:
+                with self.transaction('sync state') as con:
+                    if self.reconciling():
+                        with self.metrics.timer('stageSeconds',stage='reconcile'):
+                            self.reconcile(con)
+
+                    with self.metrics.timer('stageSeconds',stage='aggregate'):
+                        self.updateNPSDaily(con)
+
+                    self.__setLastSync(con)
+        elif not self.dbUpdate:
+            self.getUpdates()
+        else:
+            with self.metrics.timer('stageSeconds',stage='getForms'):
+                self.getForms()
+
+            with self.metrics.timer('stageSeconds',stage='getFormItems'):
+                self.getFormItems()
+
+            # All entities, sync state and log at once
+            with self.transaction('sync') as con:
+                if self.concurrentDB():
+                    # Forms and their items go to DB while responses are fetched
+                    with ThreadPoolExecutor(max_workers=1) as loader:
+                        forms=loader.submit(self.syncUpdates,con,['forms','formItems'])
+
+                        with self.metrics.timer('stageSeconds',stage='getResponses'):
+                            self.getResponses()
+
+                        forms.result()
+                else:
+                    with self.metrics.timer('stageSeconds',stage='getResponses'):
+                        self.getResponses()
+
+                    self.syncUpdates(con,['forms','formItems'])
+
+                with self.metrics.timer('stageSeconds',stage='syncUpdates'):
+                    self.syncUpdates(con,['responses','answers'])
+
+                if self.reconciling():
+                    with self.metrics.timer('stageSeconds',stage='reconcile'):
+                        self.reconcile(con)
+
+                with self.metrics.timer('stageSeconds',stage='aggregate'):
+                    self.updateNPSDaily(con)
+
+                self.__setLastSync(con)
+
+        if self.checkpoint:
+            # All done and in DB, nothing to resume anymore
+            self.checkpoint.clear()
+
+        if self.sink:
+            with self.metrics.timer('stageSeconds',stage='compact'):
+                self.compactSink()
         
         self.statistics()
 
+
+
+    def daemon(self):
+        # Sync over and over until stop(), keeping the HTTP session, the DB
+        # pool and learned chunk sizes warm. Every cycle lists forms, but
+        # only polls responses of the ones due by their recent response rate
+        # (busy forms every self.pollMinInterval seconds, dormant ones every
+        # self.pollMaxInterval) and writes what it got as a regular sync.
+        # With webhooks, polls only fill gaps: every form at the same pace
+        if self.webhookPort is not None:
+            self.scheduler=PollScheduler(self.webhookPollInterval,self.webhookPollInterval)
+        else:
+            self.scheduler=PollScheduler(self.pollMinInterval,self.pollMaxInterval,self.pollTarget)
+
+        if self.db is None:
+            self.__connectDB()
+
+        self.seedScheduler()
+
+        if self.webhookPort is not None:
+            self.serveWebhooks()
+
+        while not self.stopping.is_set():
+            start=time.time()
+
+            try:
+                with self.writeLock:
+                    self.newCycle()
+                    self.sync()
+            except Exception:
+                self.logger.error('Sync failed, trying again in {:.0f}s'.format(self.pollMinInterval), exc_info=True)
+                self.stopping.wait(self.pollMinInterval)
+                continue
+
+            if self.reconciledAt:
+                self.lastReconciled=self.reconciledAt
+
+            # Only first cycle restarts
+            self.restart=False
+            self.restartForms=[]
+
+            polled=self.metrics.by('form')
+            for form in self.pollForms or []:
+                self.scheduler.record(form,polled.get(form,{}).get('responsesTransformed',0),start)
+
+            wait=self.scheduler.wait(time.time())
+            wait=self.pollListInterval if wait is None else min(wait,self.pollListInterval)
+
+            self.logger.info('Next sync in {:.0f}s'.format(wait))
+            self.stopping.wait(max(1,wait))
+
+        if self.webhooks:
+            self.webhooks.stop()
+
+        self.logger.info('Daemon stopped')
+
+
+
+    def stop(self):
+        # Make daemon() return after its current cycle
+        self.stopping.set()
+
+
+
+    def seedScheduler(self):
+        # Initial response rate of each form from its responses of the last
+        # self.pollHistoryDays days in DB, so the first cycle polls everything
+        # and the following ones already follow each form's pace
+        if self.restart:
+            return
+
+        since=datetime.utcnow() - timedelta(days=self.pollHistoryDays)
+
+        history=pd.read_sql(
+            sqlalchemy.text(f"select form, count(*) as responses from {self.tablePrefix}responses where landed > :since group by form"),
+            self.db,
+            params={'since': since}
+        )
+
+        now=time.time()
+        for row in history.itertuples():
+            self.scheduler.seed(row.form,row.responses/(self.pollHistoryDays*86400),now)
+
+
+
+    def newCycle(self):
+        # Fresh counters and deltas for the next sync of a daemon
+        self.metrics=Metrics()
+        self.counters=self.metrics.totals
+        self.touchedDays=set()
+        self.newestLanded=None
+        self.responses=None
+        self.answers=None
+        self.pollForms=None
+        self.reconciledAt=None
+
+        with self.sinkLock:
+            self.sinkPending={}
+
+
+
+    def serveWebhooks(self):
+        # Receive Typeform webhooks on self.webhookPort and write their
+        # responses to DB in micro-batches, from a background thread
+        self.webhookQueue=queue.Queue()
+        self.webhooks=WebhookReceiver(self.webhookPort,self.webhookQueue.put,self.webhookSecret)
+        self.webhooks.start()
+
+        threading.Thread(target=self.webhookBatcher,name='TypeformETL-webhook-batcher',daemon=True).start()
+
+        self.logger.info('Receiving webhooks on port {}'.format(self.webhooks.port))
+
+
+
+    def webhookBatcher(self):
+        # Collect deliveries for up to self.webhookBatchSeconds, or until
+        # self.webhookBatchSize of them, and write them together
+        while not self.stopping.is_set():
+            try:
+                events=[self.webhookQueue.get(timeout=1)]
+            except queue.Empty:
+                continue
+
+            deadline=time.monotonic() + self.webhookBatchSeconds
+            while len(events) < self.webhookBatchSize:
+                try:
+                    events.append(self.webhookQueue.get(timeout=max(0,deadline-time.monotonic())))
+                except queue.Empty:
+                    break
+
+            try:
+                with self.writeLock:
+                    self.writeWebhookBatch(events)
+            except Exception:
+                # Their forms' next polls will bring them
+                self.count('webhookFailed',len(events))
+                self.logger.error('Error writing {} webhook responses; leaving them to polling'.format(len(events)), exc_info=True)
+
+
+
+    def webhookItem(self,event):
+        # A webhook form_response as a response item of the API. Webhooks
+        # carry no metadata (IP, user agent, referer); polling fills it in.
+        formResponse=event['form_response']
+
+        return {
+            'response_id':  formResponse['token'],
+            'token':        formResponse['token'],
+            'landed_at':    formResponse.get('landed_at'),
+            'submitted_at': formResponse.get('submitted_at'),
+            'metadata':     {'user_agent': None, 'referer': None},
+            'hidden':       formResponse.get('hidden') or {},
+            'answers':      formResponse.get('answers')
+        }
+
+
+
+    def writeWebhookBatch(self,events):
+        # Transform a micro-batch of webhook deliveries, form by form, and
+        # upsert them in one transaction. Watermarks are left alone, so
+        # polling still brings these responses with their metadata, and
+        # anything webhooks missed.
+        start=time.monotonic()
+
+        byForm=collections.defaultdict(list)
+        for event in events:
+            byForm[event['form_response']['form_id']].append(self.webhookItem(event))
+
+        with self.transaction('{} webhook responses'.format(len(events))) as con:
+            # Responses of forms not yet in DB wait for polling, which also
+            # brings their definitions
+            known=set(pd.read_sql(f"select id from {self.tablePrefix}forms;",con)['id'])
+
+            frames=[]
+            for form in sorted(byForm):
+                if form not in known:
+                    self.count('webhookUnknownForm',len(byForm[form]),form=form)
+                    continue
+
+                with self.metrics.timer('transformSeconds',form=form):
+                    responses,answers=self.transformResponses(form,byForm[form])
+
+                # Keep metadata polling wrote, if any
+                frames.append((responses.drop(columns=['ip_address','agent','referer']),answers))
+
+            if len(frames) == 0:
+                return
+
+            responses=self.concatFrames([f[0] for f in frames])
+            answers=self.concatFrames([f[1] for f in frames])
+
+            self.writeEntities(
+                [
+                    (responses,'responses_temp','responses'),
+                    (answers.sort_values(by='response'),'answers_temp','answers')
+                ],
+                con
+            )
+
+            self.touchDays(responses)
+            self.updateNPSDaily(con)
+
+        self.count('webhookResponses',responses.shape[0])
+        self.count('webhookAnswers',answers.shape[0])
+
+        self.logger.info('Wrote {} webhook responses in {:.2f}s'.format(responses.shape[0],time.monotonic()-start))
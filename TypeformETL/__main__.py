@@ -3,6 +3,7 @@ import logging.handlers
 import logging
 from configobj import ConfigObj    # dnf install python3-configobj
 import argparse
+import signal
 
         
 def prepareLogging(level=logging.INFO):
@@ -40,6 +41,66 @@ def prepareArgs():
     parser.add_argument('--restart', '-r', dest='restart', default=False, action='store_true',
                         help='Ignore last sync info stored on DB and get all responses from Typeform')
 
+    parser.add_argument('--restart-form', dest='restartforms', action='append',
+                        help='Get all responses of this form from Typeform, ignoring its last sync info; can be used multiple times')
+
+    parser.add_argument('--workspace', dest='workspaces', action='append',
+                        help='Sync only forms of this workspace ID; can be used multiple times')
+
+    parser.add_argument('--workers', '-w', dest='workers', type=int,
+                        help='Number of forms to extract from Typeform in parallel (default 1, serial)')
+
+    parser.add_argument('--db-connections', dest='dbconnections', type=int,
+                        help='Number of DB connections loading staging tables in parallel (default 1); not for SQLite')
+
+    parser.add_argument('--db-chunk-bytes', dest='dbchunkbytes', type=int,
+                        help='Initial size in bytes of each chunk of rows written to DB (default 4 MiB); adapted as the sync goes')
+
+    parser.add_argument('--db-chunk-seconds', dest='dbchunkseconds', type=float,
+                        help='Chunk sizes are adapted so each chunk takes about this many seconds to write (default 1)')
+
+    parser.add_argument('--stream', '-s', dest='streaming', default=False, action='store_true',
+                        help='Write each page of responses to the database while the next ones are fetched, instead of all at the end')
+
+    parser.add_argument('--reconcile', dest='reconcile', type=float,
+                        help='Compare responses of the last this many days with Typeform, fetching the missing or completed ones and deleting the ones deleted there')
+
+    parser.add_argument('--sink', dest='sink',
+                        help='Also write everything synced as Parquet files partitioned by form and landed day, as parquet:///some/folder; needs pyarrow')
+
+    parser.add_argument('--daemon', dest='daemon', default=False, action='store_true',
+                        help='Keep running and syncing, polling each form as often as it gets responses, instead of syncing once')
+
+    parser.add_argument('--poll-min', dest='pollmin', type=float,
+                        help='In daemon mode, seconds between polls of the busiest forms (default 60)')
+
+    parser.add_argument('--poll-max', dest='pollmax', type=float,
+                        help='In daemon mode, seconds between polls of dormant forms (default 14400)')
+
+    parser.add_argument('--webhook', dest='webhookport', type=int,
+                        help='Receive Typeform webhooks on this port and write their responses right away; runs as --daemon, polling only to fill gaps')
+
+    parser.add_argument('--webhook-secret', dest='webhooksecret',
+                        help='Secret of the Typeform webhooks, to check their signature; required with --webhook')
+
+    parser.add_argument('--checkpoint', dest='checkpoint',
+                        help='Folder to record sync progress in, so an interrupted sync resumes from where it stopped')
+
+    parser.add_argument('--cache', dest='cache',
+                        help='Folder to store every page read from Typeform API, as compressed JSON lines')
+
+    parser.add_argument('--replay', dest='replay', default=False, action='store_true',
+                        help='Rebuild all data from pages in --cache folder, without accessing Typeform')
+
+    parser.add_argument('--id-digest', dest='iddigest', choices=['shake_256','blake2b'],
+                        help='Digest used to compute answer IDs (default shake_256); blake2b is faster but changes all IDs, so use it only on new databases')
+
+    parser.add_argument('--id-key', dest='idkey',
+                        help='Secret key for blake2b answer IDs')
+
+    parser.add_argument('--metrics-file', dest='metricsfile',
+                        help='File to write metrics of each sync to, in Prometheus text format, for node exporter textfile collector')
+
     parser.add_argument('--debug', '-d', dest='debug', default=False, action='store_true',
                         help='Be more verbose and output messages to console in addition to (the default) syslog')
 
@@ -62,6 +123,56 @@ def main():
 
     if args.typeform_token is None:
         args.typeform_token=context['typeform_token']
+
+    if args.checkpoint is None:
+        args.checkpoint=context.get('checkpoint')
+
+    if args.cache is None:
+        args.cache=context.get('cache')
+
+    if args.iddigest is None:
+        args.iddigest=context.get('iddigest')
+
+    if args.idkey is None:
+        args.idkey=context.get('idkey')
+
+    if args.metricsfile is None:
+        args.metricsfile=context.get('metricsfile')
+
+    if args.dbconnections is None:
+        args.dbconnections=context.get('dbconnections',1)
+
+    if args.dbchunkbytes is None:
+        args.dbchunkbytes=context.get('dbchunkbytes')
+
+    if args.dbchunkseconds is None:
+        args.dbchunkseconds=context.get('dbchunkseconds')
+
+    if args.webhookport is None:
+        args.webhookport=context.get('webhookport')
+
+    if args.webhooksecret is None:
+        args.webhooksecret=context.get('webhooksecret')
+
+    if args.pollmin is None:
+        args.pollmin=context.get('pollmin')
+
+    if args.pollmax is None:
+        args.pollmax=context.get('pollmax')
+
+    if args.workspaces is None:
+        args.workspaces=context.get('workspaces')
+        if isinstance(args.workspaces,str):
+            args.workspaces=[args.workspaces]
+
+    if args.sink is None:
+        args.sink=context.get('sink')
+
+    if args.reconcile is None:
+        args.reconcile=context.get('reconcile')
+
+    if args.workers is None:
+        args.workers=context.get('workers',1)
     
     # Merge configuration file parameters with command line arguments
     context.update(vars(args))
@@ -80,13 +191,39 @@ def main():
         token=context['typeform_token'],
         dburl=context['database'],
         restart=context['restart'],
+        restartforms=context['restartforms'],
         dbupdate=context['dbupdate'],
-        tableprefix=context['tableprefix']
+        tableprefix=context['tableprefix'],
+        workers=context['workers'],
+        dbconnections=context['dbconnections'],
+        dbchunkbytes=context['dbchunkbytes'],
+        dbchunkseconds=context['dbchunkseconds'],
+        streaming=context['streaming'],
+        checkpoint=context['checkpoint'],
+        cache=context['cache'],
+        replay=context['replay'],
+        iddigest=context['iddigest'],
+        idkey=context['idkey'],
+        metricsfile=context['metricsfile'],
+        reconcile=context['reconcile'],
+        sink=context['sink'],
+        workspaces=context['workspaces'],
+        pollmin=context['pollmin'],
+        pollmax=context['pollmax'],
+        webhookport=context['webhookport'],
+        webhooksecret=context['webhooksecret']
     )
     
     
-    # Read Typeform updates and write to DB
-    tf.sync()
+    if context['daemon'] or context['webhookport'] is not None:
+        # Finish current cycle and quit on service stop or Ctrl-C
+        signal.signal(signal.SIGTERM, lambda signum, frame: tf.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: tf.stop())
+
+        tf.daemon()
+    else:
+        # Read Typeform updates and write to DB
+        tf.sync()
     
     
 
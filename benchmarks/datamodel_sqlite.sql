@@ -0,0 +1,95 @@
+-- Tables of examples/datamodel.sql for SQLite, with "tf_" prefix, used by
+-- benchmarks/sync.py. Views are left out.
+
+CREATE TABLE IF NOT EXISTS tf_forms (
+  id varchar(8) NOT NULL PRIMARY KEY,
+  workspace varchar(8) DEFAULT NULL,
+  updated timestamp NULL DEFAULT NULL,
+  url text DEFAULT NULL,
+  title text DEFAULT NULL,
+  description text DEFAULT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tf_form_items (
+  id varchar(30) NOT NULL PRIMARY KEY,
+  parent_id varchar(30) DEFAULT NULL,
+  form varchar(8) NOT NULL REFERENCES tf_forms(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  position int NOT NULL,
+  name varchar(45) DEFAULT NULL,
+  parent_name varchar(45) DEFAULT NULL,
+  type varchar(20) DEFAULT NULL,
+  title text DEFAULT NULL,
+  description text DEFAULT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tf_responses (
+  id varchar(45) NOT NULL PRIMARY KEY,
+  form varchar(8) NOT NULL REFERENCES tf_forms(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  ip_address varchar(40),
+  landed timestamp NULL DEFAULT NULL,
+  submitted timestamp NULL DEFAULT NULL,
+  agent text DEFAULT NULL,
+  referer text DEFAULT NULL
+);
+
+CREATE INDEX IF NOT EXISTS tf_responses_landed ON tf_responses (landed);
+CREATE INDEX IF NOT EXISTS tf_responses_submitted ON tf_responses (submitted);
+
+CREATE TABLE IF NOT EXISTS tf_answers (
+  id varchar(30) NOT NULL PRIMARY KEY,
+  form varchar(8) NOT NULL REFERENCES tf_forms(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  response varchar(45) NOT NULL REFERENCES tf_responses(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  sequence int NOT NULL,
+  field varchar(30) NOT NULL,
+  data_type_hint varchar(20) DEFAULT NULL,
+  answer text DEFAULT NULL
+);
+
+CREATE INDEX IF NOT EXISTS tf_answers_data_type_hint ON tf_answers (data_type_hint);
+
+CREATE TABLE IF NOT EXISTS tf_options (
+  id integer PRIMARY KEY AUTOINCREMENT,
+  name varchar(30) NOT NULL,
+  value varchar(200) DEFAULT NULL,
+  comment varchar(255) DEFAULT NULL
+);
+
+INSERT INTO tf_options (name, value, comment) VALUES ('typeform_last', NULL, 'UTC time of last recorded answer');
+
+CREATE TABLE IF NOT EXISTS tf_sync_state (
+  form varchar(8) NOT NULL REFERENCES tf_forms(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  completed tinyint(1) NOT NULL,
+  since timestamp NULL DEFAULT NULL,
+  PRIMARY KEY (form, completed)
+);
+
+CREATE TABLE IF NOT EXISTS tf_nps_daily_counts (
+  form varchar(8) NOT NULL REFERENCES tf_forms(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  field varchar(30) NOT NULL,
+  day date NOT NULL,
+  detractors int DEFAULT 0,
+  passives int DEFAULT 0,
+  promoters int DEFAULT 0,
+  total int DEFAULT 0,
+  answer_sum double DEFAULT NULL,
+  PRIMARY KEY (form, field, day)
+);
+
+CREATE TABLE IF NOT EXISTS tf_synclog (
+  id integer PRIMARY KEY AUTOINCREMENT,
+  timestamp timestamp NULL DEFAULT NULL,
+  version varchar(10) DEFAULT NULL,
+  forms int DEFAULT 0,
+  form_items int DEFAULT 0,
+  responses int DEFAULT 0,
+  answers int DEFAULT 0,
+  duration double DEFAULT NULL,
+  api_requests int DEFAULT 0,
+  api_bytes bigint DEFAULT 0,
+  api_seconds double DEFAULT NULL,
+  api_retries int DEFAULT 0,
+  api_wait double DEFAULT NULL,
+  transform_seconds double DEFAULT NULL,
+  db_seconds double DEFAULT NULL,
+  metrics mediumtext DEFAULT NULL
+);
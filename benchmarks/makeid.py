@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+#############################################
+##
+## Micro-benchmark of answer and hidden field ID generation.
+##
+## USAGE
+## - python3 benchmarks/makeid.py [--ids 200000] [--repeat 3]
+##
+
+
+import argparse
+import base64
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from TypeformETL import IDMaker
+
+
+
+def makeIDOriginal(content):
+    # makeID() as of 0.6.1, for reference
+    machine=hashlib.new('shake_256')
+    machine.update(content.encode('UTF-8'))
+    return base64.b85encode(machine.digest(20)).decode('ascii')
+
+
+
+def best(function,repeat):
+    # Best wall time of a few runs, in seconds
+    elapsed=[]
+    for r in range(repeat):
+        start=time.perf_counter()
+        function()
+        elapsed.append(time.perf_counter()-start)
+
+    return min(elapsed)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure ID generation throughput')
+
+    parser.add_argument('--ids', '-n', dest='ids', type=int, default=200000,
+                        help='Number of IDs to compute on each run')
+
+    parser.add_argument('--repeat', '-r', dest='repeat', type=int, default=3,
+                        help='Number of runs of each case; best one is reported')
+
+    args=parser.parse_args()
+
+    # Answer IDs are all distinct; hidden field IDs repeat on every response
+    answerKeys=['Fk3x9A r{:09d} field{:03d}'.format(i//12,i%12) for i in range(args.ids)]
+    hiddenKeys=['Fk3x9Ahiddenutm_{}'.format(i%8) for i in range(args.ids)]
+
+    shake=IDMaker()
+    blake=IDMaker('blake2b')
+    keyed=IDMaker('blake2b','benchmark secret')
+
+    # Memoization and batching must never change IDs
+    assert shake.makeMany(answerKeys[:1000]) == [makeIDOriginal(k) for k in answerKeys[:1000]]
+    assert shake.make(hiddenKeys[0]) == makeIDOriginal(hiddenKeys[0])
+
+    cases=[
+        ('original, one by one',         lambda: [makeIDOriginal(k) for k in answerKeys]),
+        ('shake_256, one by one',        lambda: [shake.makeOne(k) for k in answerKeys]),
+        ('shake_256, batch',             lambda: shake.makeMany(answerKeys)),
+        ('blake2b, batch',               lambda: blake.makeMany(answerKeys)),
+        ('keyed blake2b, batch',         lambda: keyed.makeMany(answerKeys)),
+        ('original, repeated hidden',    lambda: [makeIDOriginal(k) for k in hiddenKeys]),
+        ('shake_256, memoized hidden',   lambda: [shake.make(k) for k in hiddenKeys]),
+    ]
+
+    reference=None
+    for name,function in cases:
+        elapsed=best(function,args.repeat)
+
+        if reference is None or name.startswith('original'):
+            reference=elapsed
+
+        print('{name:<30} {rate:>12,.0f} IDs/s {speedup:>6.2f}x'.format(
+            name=name,
+            rate=args.ids/elapsed,
+            speedup=reference/elapsed
+        ))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+
+#############################################
+##
+## Local stand-in for the Typeform API, for benchmarks.
+## Serves synthetic forms, form definitions (with groups and hidden fields)
+## and paginated responses, all derived from a seed, so every run sees the
+## same account. Responses are generated on request, so scale is limited
+## only by time, not memory.
+##
+## USAGE
+## - python3 benchmarks/mockapi.py --forms 20 --responses 50000
+## - Point TypeformETL to the printed URL, as benchmarks/sync.py does
+##
+
+
+import argparse
+import http.server
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+
+
+
+class MockAccount:
+    # Synthetic Typeform account. Response «i» of a form landed «interval»
+    # seconds after response «i-1» and, unless it is partial, was submitted
+    # «fill» seconds after landing, so times grow with «i» and a 'since'
+    # filter is just a lower bound on «i».
+
+    fieldTypes=[
+        # (field type, answer type)
+        ('short_text',      'text'),
+        ('opinion_scale',   'number'),
+        ('multiple_choice', 'choice'),
+        ('multiple_choice', 'choices'),
+        ('yes_no',          'boolean'),
+        ('email',           'email'),
+        ('long_text',       'text'),
+        ('date',            'date')
+    ]
+
+    start=datetime(2019,1,1)
+    interval=97 # seconds between responses
+    fill=180 # seconds to submit a response
+
+    def __init__(self,forms=10,responses=10000,fields=8,groups=2,groupFields=3,hidden=3,workspaces=3,partial=0.2,seed=1):
+        self.responses=responses
+        self.partial=partial
+        self.seed=seed
+
+        self.workspaces=['W{:05d}'.format(w) for w in range(workspaces)]
+        self.forms={}
+
+        for f in range(forms):
+            form='F{:05d}'.format(f)
+            self.forms[form]=self.makeForm(form,f,fields,groups,groupFields,hidden)
+
+
+    def makeForm(self,form,number,fields,groups,groupFields,hidden):
+        updated=self.start + timedelta(days=number)
+
+        definition={
+            'id':        form,
+            'title':     'Synthetic form {}'.format(number),
+            'workspace': {'href': 'https://api.typeform.com/workspaces/{}'.format(self.workspaces[number % len(self.workspaces)])},
+            'hidden':    ['hidden{}'.format(h) for h in range(hidden)],
+            'fields':    []
+        }
+
+        answerable=[]
+
+        def field(id,n):
+            fieldType,answerType=self.fieldTypes[n % len(self.fieldTypes)]
+            answerable.append((id,fieldType,answerType))
+            return {
+                'id':         id,
+                'ref':        'ref_{}'.format(id),
+                'title':      'Question {} of {}'.format(n,form),
+                'type':       fieldType,
+                'properties': {'description': 'Description of question {}'.format(n)}
+            }
+
+        for n in range(fields):
+            definition['fields'].append(field('{}q{:03d}'.format(form,n),n))
+
+        for g in range(groups):
+            definition['fields'].append({
+                'id':         '{}g{:03d}'.format(form,g),
+                'ref':        'group_{}'.format(g),
+                'title':      'Group {}'.format(g),
+                'type':       'group',
+                'properties': {
+                    'description': 'Group of questions {}'.format(g),
+                    'fields':      [field('{}g{:03d}s{:02d}'.format(form,g,s),fields+g*groupFields+s) for s in range(groupFields)]
+                }
+            })
+
+        return {
+            'summary': {
+                'id':              form,
+                'title':           definition['title'],
+                'last_updated_at': updated.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'self':            {'href': 'https://api.typeform.com/forms/{}'.format(form)},
+                '_links':          {'display': 'https://example.typeform.com/to/{}'.format(form)}
+            },
+            'definition': definition,
+            'answerable': answerable
+        }
+
+
+    def isPartial(self,i):
+        # Every block of 100 responses has the same share of partial ones,
+        # scattered inside the block
+        return (i*37) % 100 < round(self.partial*100)
+
+
+    def countPartial(self,n):
+        # Partial responses among the first «n»
+        share=round(self.partial*100)
+        return (n//100)*share + sum(1 for j in range(n % 100) if (j*37) % 100 < share)
+
+
+    def count(self,first,last,completed):
+        partial=self.countPartial(last) - self.countPartial(first)
+
+        if completed is None:
+            return last-first
+        elif completed == 'true':
+            return last-first-partial
+        else:
+            return partial
+
+
+    def landed(self,i):
+        return self.start + timedelta(seconds=i*self.interval)
+
+
+    def answer(self,rand,id,fieldType,answerType,i):
+        answer={'field': {'id': id, 'type': fieldType, 'ref': 'ref_{}'.format(id)}, 'type': answerType}
+
+        if answerType == 'text':
+            answer['text']='Answer {} with some free text, ãéíõú'.format(rand.randint(0,10**6))
+        elif answerType == 'number':
+            answer['number']=rand.randint(0,10)
+        elif answerType == 'choice':
+            c=rand.randint(0,4)
+            answer['choice']={'id': 'choice{}'.format(c), 'label': 'Choice {}'.format(c)}
+        elif answerType == 'choices':
+            cs=sorted(rand.sample(range(5),2))
+            answer['choices']={'ids': ['choice{}'.format(c) for c in cs], 'labels': ['Choice {}'.format(c) for c in cs]}
+        elif answerType == 'boolean':
+            answer['boolean']=rand.random() < 0.5
+        elif answerType == 'email':
+            answer['email']='user{}@example.com'.format(i)
+        elif answerType == 'date':
+            answer['date']=(self.start + timedelta(days=rand.randint(0,900))).strftime('%Y-%m-%d')
+
+        return answer
+
+
+    def response(self,form,i):
+        rand=random.Random('{}{}{}'.format(self.seed,form,i))
+        landed=self.landed(i)
+        id='{}r{:09d}'.format(form,i)
+
+        item={
+            'landing_id':  id,
+            'token':       id,
+            'response_id': id,
+            'landed_at':   landed.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'metadata':    {
+                'user_agent': 'Mozilla/5.0 (synthetic {})'.format(rand.randint(0,50)),
+                'platform':   'other',
+                'referer':    'https://example.typeform.com/to/{}?utm={}'.format(form,rand.randint(0,9)),
+                'network_id': '{:x}'.format(rand.getrandbits(40))
+            },
+            'hidden':      {h: 'value{}'.format(rand.randint(0,99)) for h in self.forms[form]['definition']['hidden']}
+        }
+
+        answerable=self.forms[form]['answerable']
+
+        if self.isPartial(i):
+            # Partial responses answered only some questions, or none
+            answered=rand.randint(0,len(answerable)//2)
+            item['answers']=[self.answer(rand,*a,i) for a in answerable[:answered]] or None
+        else:
+            item['submitted_at']=(landed + timedelta(seconds=self.fill)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            item['answers']=[self.answer(rand,*a,i) for a in answerable]
+
+        return item
+
+
+    def listResponses(self,form,since=None,completed=None,before=None,pageSize=25,ids=None,fields=None):
+        # Page of responses, newest first, as GET /forms/{id}/responses;
+        # only the ones in «ids», if given, and only answers to «fields»
+        if ids is not None:
+            wanted=sorted((int(id[-9:]) for id in ids if id.startswith(form + 'r') and int(id[-9:]) < self.responses),reverse=True)
+            items=[self.onlyFields(self.response(form,i),fields) for i in wanted[:pageSize]]
+
+            return {
+                'total_items': len(wanted),
+                'page_count':  math.ceil(len(wanted)/pageSize) if wanted else 0,
+                'items':       items
+            }
+
+        first=0
+
+        if since:
+            # Responses landed (or submitted) strictly after «since»
+            since=datetime.strptime(since[:19],'%Y-%m-%dT%H:%M:%S')
+            offset=self.fill if completed == 'true' else 0
+            first=max(0,math.floor(((since - self.start).total_seconds() - offset)/self.interval) + 1)
+
+        last=self.responses
+        if before:
+            last=min(last,int(before[-9:]))
+
+        def wanted(i):
+            return completed is None or (completed == 'true') != self.isPartial(i)
+
+        # Walk backwards from newest
+        items=[]
+        i=last-1
+        while i >= first and len(items) < pageSize:
+            if wanted(i):
+                items.append(self.onlyFields(self.response(form,i),fields))
+            i-=1
+
+        left=self.count(first,last,completed) if last > first else 0
+
+        return {
+            'total_items': left,
+            'page_count':  math.ceil(left/pageSize) if left else 0,
+            'items':       items
+        }
+
+
+    def onlyFields(self,item,fields):
+        if fields is not None and item['answers'] is not None:
+            item['answers']=[a for a in item['answers'] if a['field']['id'] in fields]
+
+        return item
+
+
+    def listForms(self,page=1,pageSize=10,workspace=None):
+        forms=[f['summary'] for f in self.forms.values() if workspace is None or f['definition']['workspace']['href'].endswith(workspace)]
+
+        return {
+            'total_items': len(forms),
+            'page_count':  math.ceil(len(forms)/pageSize),
+            'items':       forms[(page-1)*pageSize:page*pageSize]
+        }
+
+
+    def listWorkspaces(self,page=1,pageSize=10):
+        workspaces=[
+            {'id': w, 'name': 'Workspace {}'.format(w), 'self': {'href': 'https://api.typeform.com/workspaces/{}'.format(w)}}
+            for w in self.workspaces
+        ]
+
+        return {
+            'total_items': len(workspaces),
+            'page_count':  math.ceil(len(workspaces)/pageSize),
+            'items':       workspaces[(page-1)*pageSize:page*pageSize]
+        }
+
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    account=None
+    latency=0 # seconds added to every request, to simulate network
+    requests=0
+    lock=threading.Lock()
+
+    def log_message(self,format,*args):
+        pass
+
+
+    def send(self,status,body):
+        payload=json.dumps(body).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type','application/json; charset=utf-8')
+        self.send_header('Content-Length',str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def do_GET(self):
+        with self.lock:
+            type(self).requests+=1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if not self.headers.get('Authorization','').startswith('Bearer '):
+            return self.send(401,{'code': 'AUTHENTICATION_FAILED', 'description': 'Missing bearer token'})
+
+        url=urllib.parse.urlparse(self.path)
+        query={k: v[-1] for k,v in urllib.parse.parse_qs(url.query).items()}
+        path=url.path.strip('/').split('/')
+
+        page=int(query.get('page',1))
+        pageSize=min(int(query.get('page_size',10)),1000)
+
+        if path == ['forms']:
+            return self.send(200,self.account.listForms(page,pageSize,query.get('workspace_id')))
+
+        if path == ['workspaces']:
+            return self.send(200,self.account.listWorkspaces(page,pageSize))
+
+        if len(path) >= 2 and path[0] == 'forms' and path[1] in self.account.forms:
+            if len(path) == 2:
+                return self.send(200,self.account.forms[path[1]]['definition'])
+
+            if path[2:] == ['responses']:
+                return self.send(200,self.account.listResponses(
+                    path[1],
+                    since=query.get('since'),
+                    completed=query.get('completed'),
+                    before=query.get('before'),
+                    pageSize=int(query.get('page_size',25)),
+                    ids=query['included_response_ids'].split(',') if 'included_response_ids' in query else None,
+                    fields=query['fields'].split(',') if 'fields' in query else None
+                ))
+
+        self.send(404,{'code': 'NOT_FOUND', 'description': 'Not found'})
+
+
+
+def serve(port=0,latency=0,**account):
+    # Start a mock API in a background thread and return its server;
+    # base URL is server.url
+    handler=type('Handler',(MockHandler,),{'account': MockAccount(**account), 'latency': latency, 'requests': 0})
+    server=http.server.ThreadingHTTPServer(('127.0.0.1',port),handler)
+    server.daemon_threads=True
+    server.url='http://127.0.0.1:{}'.format(server.server_port)
+
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+
+    return server
+
+
+
+def pointTo(tf,url):
+    # Make a TypeformETL object talk to the API at «url» instead of Typeform
+    for attribute in ['workspaceListURL','formListURL','formItemsURL','respListURL','respReconcileURL','respIDsURL']:
+        setattr(tf,attribute,getattr(tf,attribute).replace('https://api.typeform.com',url))
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic Typeform account on a local port')
+
+    parser.add_argument('--port', '-p', dest='port', type=int, default=8999,
+                        help='Port to listen on (0 for any free port)')
+
+    parser.add_argument('--forms', '-f', dest='forms', type=int, default=10,
+                        help='Number of forms')
+
+    parser.add_argument('--responses', '-n', dest='responses', type=int, default=10000,
+                        help='Number of responses per form')
+
+    parser.add_argument('--fields', dest='fields', type=int, default=8,
+                        help='Number of top level fields per form')
+
+    parser.add_argument('--groups', dest='groups', type=int, default=2,
+                        help='Number of groups of fields per form')
+
+    parser.add_argument('--group-fields', dest='groupFields', type=int, default=3,
+                        help='Number of fields in each group')
+
+    parser.add_argument('--hidden', dest='hidden', type=int, default=3,
+                        help='Number of hidden fields per form')
+
+    parser.add_argument('--partial', dest='partial', type=float, default=0.2,
+                        help='Share of responses that were not submitted')
+
+    parser.add_argument('--latency', dest='latency', type=float, default=0,
+                        help='Seconds added to every request, to simulate network')
+
+    parser.add_argument('--seed', dest='seed', type=int, default=1,
+                        help='Seed of all synthetic data')
+
+    args=parser.parse_args()
+
+    server=serve(
+        port=args.port, latency=args.latency,
+        forms=args.forms, responses=args.responses, fields=args.fields,
+        groups=args.groups, groupFields=args.groupFields, hidden=args.hidden,
+        partial=args.partial, seed=args.seed
+    )
+
+    print('Mock Typeform API on {}'.format(server.url),flush=True)
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+
+if __name__ == "__main__":
+    main()
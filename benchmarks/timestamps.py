@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+#############################################
+##
+## Benchmark of timestamp parsing inside getResponses(), on synthetic pages
+## of responses, without network or database.
+##
+## USAGE
+## - python3 benchmarks/timestamps.py [--forms 4] [--responses 20000]
+##
+
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+import pandas as pd
+from dateutil import parser as dateparser
+
+from TypeformETL import TypeformETL
+
+
+
+def makePages(form,responses,pageSize):
+    # Response items as Typeform sends them, split in pages
+    base=datetime.datetime(2020,1,1)
+    items=[]
+
+    for i in range(responses):
+        landed=base + datetime.timedelta(seconds=i*97)
+        item={
+            'response_id': '{}{:08d}'.format(form,i),
+            'token':       '{}{:08d}'.format(form,i),
+            'landed_at':   landed.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'metadata':    {'user_agent': 'Mozilla/5.0', 'referer': 'https://example.com/', 'network_id': 'n{}'.format(i)},
+            'hidden':      {'utm_source': 'newsletter'},
+            'answers':     [
+                {'field': {'id': 'nps'}, 'type': 'number', 'number': i % 11},
+                {'field': {'id': 'why'}, 'type': 'text', 'text': 'because {}'.format(i)}
+            ]
+        }
+
+        if i % 4:
+            item['submitted_at']=(landed + datetime.timedelta(minutes=2)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        items.append(item)
+
+    return [items[p:p+pageSize] for p in range(0,len(items),pageSize)]
+
+
+
+def parseDateutil(self,timestamps):
+    # One dateparser.parse() per timestamp, as up to 0.6.1
+    return pd.DatetimeIndex([dateparser.parse(t).replace(tzinfo=None) if t else None for t in timestamps])
+
+
+
+def parsePandas(self,timestamps):
+    # Format inferred by pandas
+    return pd.to_datetime(timestamps, utc=True).tz_localize(None)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure timestamp parsing cost per response inside getResponses()')
+
+    parser.add_argument('--forms', '-f', dest='forms', type=int, default=4,
+                        help='Number of synthetic forms')
+
+    parser.add_argument('--responses', '-n', dest='responses', type=int, default=20000,
+                        help='Number of responses per form')
+
+    args=parser.parse_args()
+
+    forms=['F{:05d}'.format(f) for f in range(args.forms)]
+    pages={form: makePages(form,args.responses,TypeformETL.respPageSize) for form in forms}
+    total=args.forms*args.responses
+
+    parsers=[
+        ('dateutil', parseDateutil),
+        ('pandas',   parsePandas),
+        ('fast',     TypeformETL.parseTimestamps)
+    ]
+
+    results={}
+    for name,parse in parsers:
+        tf=TypeformETL(token='benchmark')
+        tf.forms=pd.DataFrame(index=pd.Index(forms,name='id'))
+
+        # Synthetic pages instead of the API; all pages are completed ones
+        tf.iterResponsePages=lambda form,completed=None,before=None: iter(pages[form] if completed else [])
+        tf.parseTimestamps=parse.__get__(tf)
+
+        start=time.perf_counter()
+        tf.getResponses()
+        elapsed=time.perf_counter()-start
+
+        results[name]=tf.responses
+
+        print('{name:<10} {total:>8.2f}s {perResponse:>8.1f}µs/response {rate:>10,.0f} responses/s'.format(
+            name=name,
+            total=elapsed,
+            perResponse=1e6*elapsed/total,
+            rate=total/elapsed
+        ))
+
+    for name in results:
+        pd.testing.assert_frame_equal(results[name],results['fast'])
+
+
+
+if __name__ == "__main__":
+    main()
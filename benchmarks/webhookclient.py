@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+#############################################
+##
+## Posts Typeform webhook deliveries to a TypeformETL webhook receiver
+## (python3 -m TypeformETL --webhook PORT), signed as Typeform does, and
+## reports deliveries/s.
+## Payloads are recorded ones, from JSON lines files with one delivery per
+## line, or synthetic ones made from the benchmark mock account.
+##
+## USAGE
+## - python3 benchmarks/webhookclient.py --url http://localhost:8080/ --secret s3cr3t recorded.jsonl
+## - python3 benchmarks/webhookclient.py --url http://localhost:8080/ --synthetic 1000 --first 10000
+## - python3 benchmarks/webhookclient.py --synthetic 100 --save recorded.jsonl (no posting)
+##
+
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import mockapi
+
+
+
+def sign(secret,body):
+    # Same as Typeform: base64 of HMAC-SHA256 of the body
+    return 'sha256=' + base64.b64encode(hmac.new(secret.encode('utf-8'),body,hashlib.sha256).digest()).decode('ascii')
+
+
+
+def synthetic(account,n,first):
+    # Deliveries of submitted responses «first» onwards of the mock account,
+    # round robin over its forms, as Typeform would push them
+    deliveries=[]
+    forms=sorted(account.forms)
+    i=first
+
+    while len(deliveries) < n:
+        if not account.isPartial(i):
+            for form in forms:
+                item=account.response(form,i)
+                definition=account.forms[form]['definition']
+
+                deliveries.append({
+                    'event_id':   '{}e{:09d}'.format(form,i),
+                    'event_type': 'form_response',
+                    'form_response': {
+                        'form_id':      form,
+                        'token':        item['token'],
+                        'landed_at':    item['landed_at'],
+                        'submitted_at': item['submitted_at'],
+                        'hidden':       item['hidden'],
+                        'definition':   {'id': form, 'title': definition['title'], 'fields': definition['fields']},
+                        'answers':      item['answers']
+                    }
+                })
+
+                if len(deliveries) == n:
+                    break
+        i+=1
+
+    return deliveries
+
+
+
+def post(url,secret,delivery):
+    body=json.dumps(delivery).encode('utf-8')
+    request=urllib.request.Request(url,data=body,method='POST',headers={'Content-Type': 'application/json'})
+
+    if secret:
+        request.add_header('Typeform-Signature',sign(secret,body))
+
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Post recorded or synthetic Typeform webhook deliveries to a TypeformETL webhook receiver')
+
+    parser.add_argument('files', nargs='*',
+                        help='JSON lines files of recorded deliveries')
+
+    parser.add_argument('--url', dest='url', default='http://127.0.0.1:8080/',
+                        help='URL of the webhook receiver')
+
+    parser.add_argument('--secret', dest='secret',
+                        help='Webhook secret to sign deliveries with')
+
+    parser.add_argument('--synthetic', dest='synthetic', type=int, default=0,
+                        help='Number of synthetic deliveries made from the mock account')
+
+    parser.add_argument('--first', dest='first', type=int, default=0,
+                        help='Number of the first synthetic response; above --responses of the mock API they are new to it')
+
+    parser.add_argument('--forms', '-f', dest='forms', type=int, default=10,
+                        help='Number of forms of the mock account, as in benchmarks/mockapi.py')
+
+    parser.add_argument('--save', dest='save',
+                        help='Save deliveries to this JSON lines file instead of posting them')
+
+    parser.add_argument('--concurrency', '-c', dest='concurrency', type=int, default=4,
+                        help='Deliveries posted in parallel')
+
+    args=parser.parse_args()
+
+    deliveries=[]
+    for file in args.files:
+        with open(file) as f:
+            deliveries.extend(json.loads(line) for line in f if line.strip())
+
+    if args.synthetic:
+        deliveries.extend(synthetic(mockapi.MockAccount(forms=args.forms,responses=0),args.synthetic,args.first))
+
+    if args.save:
+        with open(args.save,'w') as f:
+            for delivery in deliveries:
+                f.write(json.dumps(delivery) + '\n')
+        return
+
+    start=time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        statuses=list(executor.map(lambda d: post(args.url,args.secret,d),deliveries))
+    elapsed=time.perf_counter()-start
+
+    print('{} deliveries in {:.2f}s ({:,.0f}/s); HTTP status: {}'.format(
+        len(deliveries),
+        elapsed,
+        len(deliveries)/elapsed if elapsed else 0,
+        ', '.join('{} ×{}'.format(s,statuses.count(s)) for s in sorted(set(statuses)))
+    ))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@
 -- If recreating the database from scratch, to avoid foreign key constrains, 
 -- delete all tables first in this order:
 
+DROP TABLE IF EXISTS tf_nps_daily_counts;
+DROP TABLE IF EXISTS tf_sync_state;
 DROP TABLE IF EXISTS tf_answers;
 DROP TABLE IF EXISTS tf_responses;
 DROP TABLE IF EXISTS tf_form_items;
@@ -132,6 +134,71 @@ CREATE TABLE tf_options (
 
 
 
+--
+-- Table structure for table tf_sync_state
+--
+
+CREATE TABLE IF NOT EXISTS tf_sync_state (
+  form varchar(8) CHARACTER SET ascii NOT NULL COMMENT 'Form ID',
+  completed tinyint(1) NOT NULL COMMENT '1 for submitted responses, 0 for partial responses',
+  since timestamp NULL DEFAULT NULL COMMENT 'Newest submitted (completed) or landed (partial) time already synced, UTC',
+  PRIMARY KEY (form, completed),
+  FOREIGN KEY fk_sync_state_form (form) REFERENCES tf_forms(id) ON UPDATE CASCADE ON DELETE CASCADE
+) DEFAULT CHARSET=utf8 COMMENT='Per form sync watermarks';
+
+-- Databases created before 0.7 get this table, without its foreign key, on
+-- their first sync, seeded from tf_responses. Create it as above beforehand
+-- to have the foreign key too.
+
+
+
+
+
+
+
+
+--
+-- Table structure for table tf_nps_daily_counts
+--
+
+CREATE TABLE IF NOT EXISTS tf_nps_daily_counts (
+  form varchar(8) CHARACTER SET ascii NOT NULL COMMENT 'Form ID',
+  field varchar(30) CHARACTER SET ascii NOT NULL COMMENT 'Field ID of number answers',
+  day date NOT NULL COMMENT 'UTC day responses were submitted',
+  detractors int unsigned DEFAULT 0 COMMENT 'Answers below 7',
+  passives int unsigned DEFAULT 0 COMMENT 'Answers 7 and 8',
+  promoters int unsigned DEFAULT 0 COMMENT 'Answers 9 and above',
+  total int unsigned DEFAULT 0 COMMENT 'Number of answers',
+  answer_sum double DEFAULT NULL COMMENT 'Sum of answers, for averages',
+  PRIMARY KEY (form, field, day),
+  FOREIGN KEY fk_nps_daily_counts_form (form) REFERENCES tf_forms(id) ON UPDATE CASCADE ON DELETE CASCADE
+) DEFAULT CHARSET=utf8 COMMENT='Daily NPS counts per form and field, updated by each sync only on the days it touched';
+
+-- The next sync fills an empty tf_nps_daily_counts with all days by itself.
+-- To rebuild it by hand, all days at once:
+-- DELETE FROM tf_nps_daily_counts;
+-- INSERT INTO tf_nps_daily_counts (form, field, day, detractors, passives, promoters, total, answer_sum)
+--   SELECT
+--     a.form,
+--     a.field,
+--     date(r.submitted),
+--     count(case when CAST(a.answer AS DECIMAL(10,2)) < 7 then 1 else NULL end),
+--     count(case when CAST(a.answer AS DECIMAL(10,2)) between 7 and 8 then 1 else NULL end),
+--     count(case when CAST(a.answer AS DECIMAL(10,2)) >= 9 then 1 else NULL end),
+--     count(a.answer),
+--     sum(CAST(a.answer AS DECIMAL(10,2)))
+--   FROM tf_answers a
+--   JOIN tf_responses r ON r.id = a.response
+--   WHERE a.data_type_hint = 'number' AND r.submitted IS NOT NULL
+--   GROUP BY a.form, a.field, date(r.submitted);
+
+
+
+
+
+
+
+
 --
 -- Table structure for table tf_synclog
 --
@@ -144,9 +211,30 @@ CREATE TABLE IF NOT EXISTS tf_synclog (
   form_items int(10) unsigned DEFAULT 0 COMMENT 'Number of form fields read in this sync',
   responses int(10) unsigned DEFAULT 0 COMMENT 'Number of responses written in this sync',
   answers int(10) unsigned DEFAULT 0 COMMENT 'Number of answers written in this sync',
+  duration double DEFAULT NULL COMMENT 'Seconds since sync started, until it was logged',
+  api_requests int(10) unsigned DEFAULT 0 COMMENT 'Number of Typeform API requests',
+  api_bytes bigint unsigned DEFAULT 0 COMMENT 'Bytes read from Typeform API',
+  api_seconds double DEFAULT NULL COMMENT 'Seconds waiting for Typeform API responses',
+  api_retries int(10) unsigned DEFAULT 0 COMMENT 'Number of retried API requests',
+  api_wait double DEFAULT NULL COMMENT 'Seconds waiting before retries and under rate limit',
+  transform_seconds double DEFAULT NULL COMMENT 'Seconds transforming responses',
+  db_seconds double DEFAULT NULL COMMENT 'Seconds writing to database',
+  metrics mediumtext DEFAULT NULL COMMENT 'JSON with all metrics, per stage, endpoint and table',
   PRIMARY KEY (id)
 ) DEFAULT CHARSET=utf8;
 
+-- Sync logs created before 0.7 can be upgraded with:
+-- ALTER TABLE tf_synclog
+--   ADD COLUMN duration double DEFAULT NULL,
+--   ADD COLUMN api_requests int(10) unsigned DEFAULT 0,
+--   ADD COLUMN api_bytes bigint unsigned DEFAULT 0,
+--   ADD COLUMN api_seconds double DEFAULT NULL,
+--   ADD COLUMN api_retries int(10) unsigned DEFAULT 0,
+--   ADD COLUMN api_wait double DEFAULT NULL,
+--   ADD COLUMN transform_seconds double DEFAULT NULL,
+--   ADD COLUMN db_seconds double DEFAULT NULL,
+--   ADD COLUMN metrics mediumtext DEFAULT NULL;
+
 
 
 
@@ -254,6 +342,49 @@ order by
 
 
 
+--
+-- View definition for tf_nps_daily_fast
+-- Same as tf_nps_daily, one row per day, from the tf_nps_daily_counts aggregates
+--
+
+DROP VIEW IF EXISTS tf_nps_daily_fast;
+CREATE OR REPLACE VIEW tf_nps_daily_fast AS
+select
+	d.form as form_id,
+	fi.name as field_name,
+	d.day as date,
+	fi.type as type,
+	f.title as form_title,
+	fi.title as field_title,
+
+	(d.promoters-d.detractors)/d.total as NPS_ofdate,
+	d.detractors,
+	d.passives,
+	d.promoters,
+	d.total,
+	d.answer_sum/d.total as average,
+
+	(sum(d.promoters) over untilday - sum(d.detractors) over untilday)/(sum(d.total) over untilday) as NPS_cumulative,
+	sum(d.detractors) over untilday as detr_cumulative,
+	sum(d.passives) over untilday as pass_cumulative,
+	sum(d.promoters) over untilday as prom_cumulative,
+	sum(d.total) over untilday as totl_cumulative
+from
+	tf_nps_daily_counts d,
+	tf_form_items fi,
+	tf_forms f
+where
+	fi.id = d.field
+	and f.id = d.form
+window
+	untilday as (partition by d.form, d.field order by d.day asc rows unbounded preceding)
+order by
+	d.form, d.field, d.day asc;
+
+
+
+
+
 --
 -- View definition for tf_nps
 --
@@ -14,6 +14,9 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/avibrazil/Typeform-ETL",
     install_requires=['sqlalchemy','pandas','requests','configobj'],
+    extras_require={
+        'parquet': ['pyarrow']
+    },
     data_files=[('share/TypeformETL/examples',['examples/datamodel.sql', 'examples/NPS Analysis.ipynb','examples/syncFromTypeform.conf.example'])],
     packages=setuptools.find_packages(),
     classifiers=[
@@ -0,0 +1,145 @@
+#############################################
+##
+## tf_nps_daily_counts on SQLite, against the mock API of the benchmarks:
+## after full and incremental syncs, after deletes and when filled from
+## empty, it must equal a recompute of all days from answers.
+##
+## USAGE
+## - python3 -m pytest tests
+##
+
+
+import os
+import sys
+import tempfile
+import unittest
+
+import pandas as pd
+import sqlalchemy
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','benchmarks'))
+
+from TypeformETL import TypeformETL
+import mockapi
+from sync import prepareDatabase
+
+
+
+class NPSDaily(unittest.TestCase):
+
+    def setUp(self):
+        self.folder=tempfile.TemporaryDirectory()
+        self.dburl='sqlite:///' + os.path.join(self.folder.name,'nps.db')
+        prepareDatabase(self.dburl)
+
+        # A response every 97s, so 1500 of them span 2 days per form
+        self.api=mockapi.serve(forms=2,responses=1500)
+        self.account=self.api.RequestHandlerClass.account
+
+
+    def tearDown(self):
+        self.api.shutdown()
+        self.api.server_close()
+        self.folder.cleanup()
+
+
+    def sync(self):
+        tf=TypeformETL(token='test',dburl=self.dburl,tableprefix='tf_')
+        mockapi.pointTo(tf,self.api.url)
+        tf.apiRateLimit=None
+        tf.rateLimiter=None
+        tf.sync()
+        return tf
+
+
+    def table(self,tf):
+        return pd.read_sql(
+            'SELECT form, field, day, detractors, passives, promoters, total, answer_sum FROM tf_nps_daily_counts ORDER BY form, field, day',
+            tf.db
+        )
+
+
+    def recompute(self,tf):
+        # All days, in pandas, from what is in DB
+        answers=pd.read_sql(
+            """SELECT a.form, a.field, r.submitted, a.answer FROM tf_answers a JOIN tf_responses r ON r.id = a.response
+               WHERE a.data_type_hint = 'number' AND r.submitted IS NOT NULL""",
+            tf.db
+        )
+        answers['day']=pd.to_datetime(answers['submitted']).dt.strftime('%Y-%m-%d')
+        answers['answer']=answers['answer'].astype(float)
+
+        expected=answers.groupby(['form','field','day']).agg(
+            detractors=('answer',lambda a: int((a < 7).sum())),
+            passives=('answer',lambda a: int(a.between(7,8).sum())),
+            promoters=('answer',lambda a: int((a >= 9).sum())),
+            total=('answer','count'),
+            answer_sum=('answer','sum')
+        ).reset_index()
+
+        return expected
+
+
+    def assertAggregated(self,tf):
+        got=self.table(tf)
+        expected=self.recompute(tf)
+
+        self.assertGreater(got.shape[0],0)
+        pd.testing.assert_frame_equal(got,expected,check_dtype=False)
+
+
+    def testFullAndIncremental(self):
+        tf=self.sync()
+        self.assertAggregated(tf)
+
+        # New responses, on the last day and on new ones
+        self.account.responses=2500
+        tf=self.sync()
+        self.assertGreater(tf.counters['npsDaysUpdated'],0)
+        self.assertAggregated(tf)
+
+
+    def testDeletedResponses(self):
+        tf=self.sync()
+
+        # All responses of a form's first day: its buckets must go away
+        responses=pd.read_sql("SELECT id, submitted FROM tf_responses WHERE form='F00000' AND submitted IS NOT NULL",tf.db)
+        first=pd.to_datetime(responses['submitted']).dt.date.min()
+        gone=list(responses['id'][pd.to_datetime(responses['submitted']).dt.date == first])
+        # And one of another day
+        gone.append(responses['id'][pd.to_datetime(responses['submitted']).dt.date > first].iloc[0])
+
+        with tf.transaction('delete') as con:
+            tf.deleteResponses(gone,con)
+            tf.updateNPSDaily(con)
+
+        table=self.table(tf)
+        self.assertFalse(((table['form'] == 'F00000') & (table['day'] == str(first))).any())
+        self.assertAggregated(tf)
+
+
+    def testFilledWhenEmpty(self):
+        tf=self.sync()
+
+        with tf.db.begin() as con:
+            con.exec_driver_sql('DELETE FROM tf_nps_daily_counts')
+
+        # Nothing new to sync, but the empty table is filled with all days
+        tf=self.sync()
+        self.assertEqual(tf.counters['responses'],0)
+        self.assertAggregated(tf)
+
+
+    def testNotAnAggregate(self):
+        # Something else under the same name is left alone, and the sync works
+        with sqlalchemy.create_engine(self.dburl).begin() as con:
+            con.exec_driver_sql('DROP TABLE tf_nps_daily_counts')
+            con.exec_driver_sql('CREATE VIEW tf_nps_daily_counts AS SELECT id AS form_id FROM tf_forms')
+
+        tf=self.sync()
+        self.assertGreater(tf.counters['responses'],0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
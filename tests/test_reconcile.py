@@ -0,0 +1,143 @@
+#############################################
+##
+## --reconcile on SQLite, against the mock API of the benchmarks: responses
+## deleted on Typeform are deleted, partial responses submitted later are
+## fetched again, and nothing that landed before the window is deleted.
+##
+## USAGE
+## - python3 -m pytest tests
+##
+
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import pandas as pd
+import sqlalchemy
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','benchmarks'))
+
+from TypeformETL import TypeformETL
+import mockapi
+from sync import prepareDatabase
+
+
+
+class Reconcile(unittest.TestCase):
+
+    days=2 # reconcile window
+
+    def setUp(self):
+        self.folder=tempfile.TemporaryDirectory()
+        self.dburl='sqlite:///' + os.path.join(self.folder.name,'reconcile.db')
+        prepareDatabase(self.dburl)
+        self.db=sqlalchemy.create_engine(self.dburl)
+
+        # A response every 97s from 3 days ago: the last ~2 days are in the
+        # reconcile window, the first ~1300 responses of each form are not
+        self.api=mockapi.serve(forms=2,responses=2000)
+        self.account=self.api.RequestHandlerClass.account
+        self.account.start=datetime.utcnow().replace(microsecond=0) - timedelta(days=3)
+
+        self.sync()
+        self.since=datetime.utcnow() - timedelta(days=self.days)
+
+
+    def tearDown(self):
+        self.api.shutdown()
+        self.api.server_close()
+        self.db.dispose()
+        self.folder.cleanup()
+
+
+    def sync(self,**args):
+        tf=TypeformETL(token='test',dburl=self.dburl,tableprefix='tf_',**args)
+        mockapi.pointTo(tf,self.api.url)
+        tf.apiRateLimit=None
+        tf.rateLimiter=None
+        tf.sync()
+        return tf
+
+
+    def responses(self):
+        return pd.read_sql('SELECT id, landed, submitted FROM tf_responses',self.db,index_col='id',parse_dates=['landed','submitted'])
+
+
+    def execute(self,sql,**params):
+        with self.db.begin() as con:
+            con.execute(sqlalchemy.text(sql),params)
+
+
+    def testDeletedUpstream(self):
+        before=self.responses()
+
+        # The 15 newest responses of each form are gone from Typeform
+        self.account.responses=1985
+        tf=self.sync(reconcile=self.days)
+
+        after=self.responses()
+        gone=before.index.difference(after.index)
+
+        self.assertEqual(len(gone),30)
+        self.assertEqual(tf.counters['reconcileDeleted'],30)
+        self.assertTrue(all(int(g[-9:]) >= 1985 for g in gone))
+
+        answers=pd.read_sql('SELECT DISTINCT response FROM tf_answers',self.db)['response']
+        self.assertEqual(len(set(answers) & set(gone)),0)
+
+
+    def testCompletedAndMissing(self):
+        responses=self.responses()
+        recent=responses[(responses['landed'] > self.since) & responses['submitted'].notna()].index
+
+        # One synced while still partial, one never synced
+        partial,missing=recent[0],recent[1]
+        answers=pd.read_sql('SELECT count(*) AS n FROM tf_answers WHERE response=:r',self.db,params={'r': partial})['n'][0]
+
+        self.execute('UPDATE tf_responses SET submitted=NULL WHERE id=:r',r=partial)
+        self.execute('DELETE FROM tf_answers WHERE response IN (:p,:m)',p=partial,m=missing)
+        self.execute('DELETE FROM tf_responses WHERE id=:m',m=missing)
+
+        # Incremental syncs don't see them
+        tf=self.sync()
+        self.assertEqual(tf.counters['responses'],0)
+        self.assertTrue(pd.isna(self.responses().at[partial,'submitted']))
+
+        tf=self.sync(reconcile=self.days)
+        self.assertEqual(tf.counters['reconcileCompleted'],1)
+        self.assertEqual(tf.counters['reconcileMissing'],1)
+
+        after=self.responses()
+        self.assertEqual(after.at[partial,'submitted'],responses.at[partial,'submitted'])
+        self.assertIn(missing,after.index)
+        self.assertEqual(
+            pd.read_sql('SELECT count(*) AS n FROM tf_answers WHERE response=:r',self.db,params={'r': partial})['n'][0],
+            answers
+        )
+
+
+    def testOlderThanWindowKept(self):
+        before=self.responses()
+        old=before[before['landed'] < self.since - timedelta(hours=1)]
+        self.assertGreater(old.shape[0],0)
+
+        # Not on Typeform: one in the window, one before it
+        ghost="INSERT INTO tf_responses (id, form, landed, submitted) VALUES (:id, 'F00000', :landed, :landed)"
+        self.execute(ghost,id='F00000rghost-new',landed=datetime.utcnow() - timedelta(hours=1))
+        self.execute(ghost,id='F00000rghost-old',landed=self.since - timedelta(hours=1))
+
+        tf=self.sync(reconcile=self.days)
+
+        after=self.responses()
+        self.assertNotIn('F00000rghost-new',after.index)
+        self.assertIn('F00000rghost-old',after.index)
+        self.assertEqual(len(old.index.difference(after.index)),0)
+        self.assertEqual(tf.counters['reconcileDeleted'],1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
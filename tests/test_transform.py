@@ -0,0 +1,188 @@
+#############################################
+##
+## Parity of TypeformETL.transformResponses() with the transform of
+## TypeformETL 0.6, kept here as a reference: same responses and answers
+## frames, value by value, for pages of the mock API of the benchmarks and
+## for some odd items.
+##
+## USAGE
+## - python3 -m pytest tests
+## - python3 -m unittest discover tests
+##
+
+
+import json
+import os
+import sys
+import unittest
+
+import pandas as pd
+from dateutil import parser as dateparser
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','benchmarks'))
+
+from TypeformETL import TypeformETL
+from mockapi import MockAccount
+
+
+
+def transformResponses06(tf,form,items):
+    # transformResponses() of TypeformETL 0.6, one dict per row
+    metas   = []
+    answers = []
+
+    for i in items:
+        meta = {}
+        meta['id']          = i['response_id']
+        meta['form']        = form
+        meta['landed']      = dateparser.parse(i['landed_at']).replace(tzinfo=None)
+        meta['agent']       = i['metadata']['user_agent']
+        meta['referer']     = i['metadata']['referer']
+
+        if 'network_id' in i['metadata']:
+            meta['ip_address'] = i['metadata']['network_id']
+
+        if 'submitted_at' in i:
+            meta['submitted'] = dateparser.parse(i['submitted_at']).replace(tzinfo=None)
+
+        metas.append(meta)
+
+        seq=0
+
+        for t in ['hidden']:
+            if t in i.keys():
+                for field in i[t].keys():
+                    answer = {}
+                    answer['id']             = tf.makeID('{}{}{}'.format(form,meta['id'],field))
+                    answer['response']       = meta['id']
+                    answer['form']           = form
+                    answer['sequence']       = seq
+                    answer['answer']         = i[t][field]
+                    answer['field']          = tf.makeID('{}{}{}'.format(form,t,field))
+                    answer['data_type_hint'] = t
+
+                    answers.append(answer)
+                    seq+=1
+
+        if 'answers' in i.keys():
+            if i['answers'] is None:
+                meta['submitted'] = None
+            else:
+                for field in i['answers']:
+                    answer = {}
+                    answer['id']             = tf.makeID('{}{}{}'.format(form,meta['id'],field['field']['id']))
+                    answer['response']       = meta['id']
+                    answer['form']           = form
+                    answer['sequence']       = seq
+                    answer['field']          = field['field']['id']
+                    answer['data_type_hint'] = field['type']
+
+                    if field['type'] == 'choices' or field['type'] == 'choice':
+                        answer['answer'] = {}
+
+                        if 'labels' in field[field['type']] or 'label' in field[field['type']]:
+                            if field['type'] == 'choices':
+                                answer['answer'] = dict(zip(
+                                    field[field['type']]['ids'],
+                                    field[field['type']]['labels']
+                                ))
+                            else:
+                                answer['answer'][field[field['type']]['id']] = str(field[field['type']]['label'])
+
+                        if 'other' in field[field['type']]:
+                            answer['answer']['other'] = field[field['type']]['other']
+
+                        answer['answer']=json.dumps(
+                            answer['answer'],
+                            ensure_ascii=False,
+                            separators=(',', ':')
+                        )
+                    else:
+                        answer['answer'] = str(field[field['type']])
+
+                    answers.append(answer)
+                    seq+=1
+
+    responses=pd.DataFrame(metas,columns=tf.responseColumns).set_index('id')
+    answers=pd.DataFrame(answers,columns=tf.answerColumns).set_index('id')
+
+    return (responses,answers)
+
+
+
+class TransformParity(unittest.TestCase):
+
+    def setUp(self):
+        self.tf=TypeformETL(token='test',dburl='sqlite://')
+
+
+    def plain(self,df):
+        # Values only: compact frames have categoricals and Arrow strings, and
+        # 0.6 had sequence as object
+        df=df.astype(object).where(df.notna(),None)
+        df.index=df.index.astype(object)
+        return df
+
+
+    def assertParity(self,form,items):
+        expected=transformResponses06(self.tf,form,items)
+
+        for compactFrames in [True,False]:
+            with self.subTest(compactFrames=compactFrames):
+                self.tf.compactFrames=compactFrames
+                got=self.tf.transformResponses(form,items)
+
+                for e,g in zip(expected,got):
+                    self.assertEqual(list(g.columns),list(e.columns))
+                    pd.testing.assert_frame_equal(self.plain(g),self.plain(e))
+
+
+    def testMockPages(self):
+        account=MockAccount(forms=3,responses=300,partial=0.3)
+
+        for form in account.forms:
+            for completed in ['true','false',None]:
+                with self.subTest(form=form,completed=completed):
+                    page=account.listResponses(form,completed=completed,pageSize=100)
+                    self.assertGreater(len(page['items']),0)
+                    self.assertParity(form,page['items'])
+
+
+    def testOddItems(self):
+        items=[
+            {   # Old API: no submitted_at, no network_id, no hidden fields
+                'response_id': 'odd1',
+                'landed_at':   '2020-02-01T10:00:00Z',
+                'metadata':    {'user_agent': 'UA', 'referer': 'http://x'},
+                'answers':     [
+                    {'field': {'id': 'c1'}, 'type': 'choice',  'choice':  {'other': 'Something else'}},
+                    {'field': {'id': 'c2'}, 'type': 'choices', 'choices': {'ids': ['a'], 'labels': ['Á'], 'other': 'More'}},
+                    {'field': {'id': 'n1'}, 'type': 'number',  'number':  7}
+                ]
+            },
+            {   # Partial, no answers at all
+                'response_id': 'odd2',
+                'landed_at':   '2020-02-01T11:00:00+00:00',
+                'metadata':    {'user_agent': 'UA', 'referer': 'http://x', 'network_id': 'abc'},
+                'hidden':      {'utm': 'x', 'src': ''},
+                'answers':     None
+            },
+            {   # Submitted, without the answers key
+                'response_id': 'odd3',
+                'landed_at':   '2020-02-01T12:00:00Z',
+                'submitted_at':'2020-02-01T12:03:00Z',
+                'metadata':    {'user_agent': 'UA', 'referer': 'http://x', 'network_id': 'def'},
+                'hidden':      {'utm': 'y'}
+            }
+        ]
+
+        self.assertParity('FODD',items)
+
+
+    def testEmptyPage(self):
+        self.assertParity('FEMPTY',[])
+
+
+
+if __name__ == '__main__':
+    unittest.main()